@@ -1,6 +1,8 @@
-from flask import Flask, render_template, abort, send_file
+from flask import Flask, render_template, abort, send_file, jsonify, Response, redirect, g, has_request_context, request
 import csv
+import json
 import os
+import threading
 from datetime import datetime, timedelta, time
 
 import matplotlib
@@ -9,19 +11,107 @@ from matplotlib import pyplot as plt
 import matplotlib.font_manager as fm
 from collections import defaultdict
 from calendar import monthrange
+from functools import partial
+
+from day_data import DayCache
+from day_index import DayIndex
+from day_store import INVALID_SEC, format_sec, read_time_texts
+from latest_status import LATEST_STATUS_PATH, TIMESTAMP_FORMAT, read_latest
+from live_events import ChangeNotifier
+from machines import DEFAULT_MACHINE, is_valid_machine, list_machines, machine_file, partition
+import fast_time
+from graph_cache import GraphCache
+from hinmoku_cache import HinmokuCache
+from http_cache import PageCache, conditional, file_fingerprint, no_store, page_uses
+from process_pool import SharedPool
+from render_worker import RenderWorker
+from state_timeline import StateTimeline
+from timeline_render import render_svg, runs_to_json
+from rollup import RollupStore, state_seconds_of
+from state_classifier import (
+    THRESHOLDS, CURRENT_THRESHOLD, STATES, STATE_COLORS, STATE_LUT, light_code,
+)
 
 
 app = Flask(__name__)
 DATA_DIR = "data/sensor"
 HINMOKU_SUBDIR = "../hinmoku"  # 品目CSVのサブディレクトリ名（data/hinmoku/）
+DAY_CACHE_MAX_BYTES = 32 * 1024 * 1024  # パース済みセンサーデータのキャッシュ上限
+DAY_CACHE_MAX_DAYS = 256  # 同じく日数の上限（大きい日のサイドカーは mmap でファイル記述子を1つ使う）
+ROLLUP_DB_PATH = "data/rollup.sqlite3"  # 日別集計（月・年度表示用）
+RANGE_SUMMARY_MAX_DAYS = 5 * 366  # /range/.../summary で指定できる最長の期間
+LIVE_POLL_INTERVAL_SEC = 1.0  # /events の購読中に最新値・品目CSVの更新を確認する間隔（stat だけ）
+GRAPH_FORMAT = "svg"  # 状態推移グラフ: "svg"（インラインSVG）/ "png"（matplotlib で static/ に画像出力）
+WORKER_PROCESSES = 4  # PNG の描画と日別集計に使うプロセス数（全機械で共用）
+GRAPH_CACHE_DIR = "static/graphs"  # 日別・品目区間グラフ PNG（ファイル名は内容のハッシュ）
+GRAPH_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 超えたら古く使われた画像から消す
+GRAPH_STYLE_VERSION = 1  # グラフの見た目（_render_day_timeline）を変えたら上げる
+# ブラウザキャッシュ（ETag で再検証）。FINAL_AFTER_DAYS 日より前の日・月は確定扱い
+FINAL_AFTER_DAYS = 2
+FINAL_MAX_AGE_SEC = 24 * 3600
+CURRENT_MAX_AGE_SEC = 30
+GRAPH_CACHE_MAX_AGE_SEC = 365 * 24 * 3600  # static/graphs/ は内容ごとに名前が違うので変わらない
+PAGE_CACHE_MAX_BYTES = 16 * 1024 * 1024  # 確定した日・月の描画済みページ
+PAGE_CACHE_SPILL_DIR = None  # 例: "data/page_cache"（メモリから溢れたページをディスクに置く）
+
+day_cache = DayCache(max_bytes=DAY_CACHE_MAX_BYTES, max_days=DAY_CACHE_MAX_DAYS)  # 全機械で共用（キーは CSV パス）
+process_pool = SharedPool(max_workers=WORKER_PROCESSES)
+
+
+class MachineContext:
+    """
+    機械ごとのデータ置き場とキャッシュ（日付索引・日別集計・年度カレンダー・ライブ通知）。
+    機械ごとに独立しているので、台数が増えても他の機械のファイルを走査しない。
+    """
 
-# 点灯/消灯の閾値
-THRESHOLDS = {
-    "red": 200,
-    "yellow": 200,
-    "green": 200
-}
-CURRENT_THRESHOLD = 3.0
+    def __init__(self, machine):
+        self.machine = machine
+        self.data_dir = partition(DATA_DIR, machine)
+        self.latest_path = machine_file(LATEST_STATUS_PATH, machine)
+        self.day_index = DayIndex(self.data_dir)
+        self.rollup_store = RollupStore(machine_file(ROLLUP_DB_PATH, machine), self.data_dir,
+                                        load_day=partial(day_cache.get, self.data_dir),
+                                        pool=process_pool if WORKER_PROCESSES > 1 else None)
+        self.calendar_cache = {}  # 年度 -> (day_index.version, calendar)
+        self.live_notifier = ChangeNotifier(partial(_live_snapshot, machine), partial(_live_sources, machine),
+                                            render=partial(_live_render, machine),
+                                            poll_interval=LIVE_POLL_INTERVAL_SEC)
+        # URL の接頭辞（既定の機械は従来どおり /date/... 、それ以外は /m/<機械>/date/...）
+        self.url_prefix = "" if machine == DEFAULT_MACHINE else f"/m/{machine}"
+
+_machine_contexts = {}
+_machine_lock = threading.Lock()
+
+def current_machine():
+    """リクエスト中の機械（URL の /m/<機械>/ から。無ければ既定の機械）"""
+    if has_request_context():
+        return g.get("machine", DEFAULT_MACHINE)
+    return DEFAULT_MACHINE
+
+def machine_ctx(machine=None):
+    """機械の MachineContext（初回に作る）。machine 省略時はリクエスト中の機械。"""
+    machine = machine or current_machine()
+    with _machine_lock:
+        ctx = _machine_contexts.get(machine)
+        if ctx is None:
+            ctx = _machine_contexts[machine] = MachineContext(machine)
+        return ctx
+
+@app.url_value_preprocessor
+def pull_machine(endpoint, values):
+    """/m/<機械>/... の機械を取り出して g.machine に置く（ビュー関数には渡さない）"""
+    machine = values.pop("machine", None) if values else None
+    if machine is None:
+        return
+    if not is_valid_machine(machine) or machine == DEFAULT_MACHINE \
+            or not os.path.isdir(partition(DATA_DIR, machine)):
+        abort(404, description=f"機械 {machine} のデータが見つかりませんでした")
+    g.machine = machine
+
+@app.context_processor
+def inject_machine():
+    machine = current_machine()
+    return {"machine": machine, "machine_prefix": machine_ctx(machine).url_prefix}
 
 # 点灯・状態判定
 def get_light_status(red, yellow, green, current):
@@ -36,111 +126,89 @@ def get_light_status(red, yellow, green, current):
 
     machine_action = "加工中" if current >= CURRENT_THRESHOLD else "加工なし"
 
-    # 状態判定
-    state, color = "不明", "gray"  # 色なし
-    r, y, g, m = status["red"], status["yellow"], status["green"], machine_action
-    
-    if r == "消灯" and y == "消灯" and g == "消灯" and m == "加工なし":
-        state, color = "不明", "gray"
-    elif r == "消灯" and y == "消灯" and g == "点灯" and m == "加工なし":
-        state, color = "加工中", "green"
-    elif r == "消灯" and y == "点灯" and g == "消灯" and m == "加工なし":
-        state, color = "加工完了", "yellow"
-    elif r == "消灯" and y == "点灯" and g == "点灯" and m == "加工なし":
-        state, color = "加工中", "green"
-    elif r == "点灯" and y == "消灯" and g == "消灯" and m == "加工なし":
-        state, color = "アラーム", "red"
-    elif r == "点灯" and y == "消灯" and g == "点灯" and m == "加工なし":
-        state, color = "加工中", "green"
-    elif r == "点灯" and y == "点灯" and g == "消灯" and m == "加工なし":
-        state, color = "加工完了", "yellow"
-    elif r == "点灯" and y == "点灯" and g == "点灯" and m == "加工なし":
-        state, color = "加工中", "green"
-    elif r == "消灯" and y == "消灯" and g == "消灯" and m == "加工中":
-        state, color = "手動加工中", "blue"
-    elif r == "消灯" and y == "消灯" and g == "点灯" and m == "加工中":
-        state, color = "加工中", "green"
-    elif r == "消灯" and y == "点灯" and g == "消灯" and m == "加工中":
-        state, color = "手動加工中", "blue"
-    elif r == "消灯" and y == "点灯" and g == "点灯" and m == "加工中":
-        state, color = "加工中", "green"
-    elif r == "点灯" and y == "消灯" and g == "消灯" and m == "加工中":
-        state, color = "手動加工中", "blue"
-    elif r == "点灯" and y == "消灯" and g == "点灯" and m == "加工中":
-        state, color = "加工中", "green"
-    elif r == "点灯" and y == "点灯" and g == "消灯" and m == "加工中":
-        state, color = "手動加工中", "blue"
-    elif r == "点灯" and y == "点灯" and g == "点灯" and m == "加工中":
-        state, color = "加工中", "green"
+    # 状態判定（16通りの組み合わせは STATE_LUT を参照）
+    code = STATE_LUT[light_code(red, yellow, green, current)]
+    state, color = STATES[code], STATE_COLORS[code]
 
     return status, machine_action, state, color
 
 # 最新データ取得
-def get_latest_data():
+def get_latest_data(machine=None):
+    ctx = machine_ctx(machine)
     now = datetime.now()
     threshold = now - timedelta(minutes=5)
-    latest_row = None
 
-    for filename in sorted(os.listdir(DATA_DIR), reverse=True):
-        if not filename.endswith(".csv"):
+    # ロガーが公開している最新値（ファイル1つ読むだけ）
+    sample = read_latest(ctx.latest_path)
+    if sample is not None:
+        try:
+            row_time = datetime.strptime(sample["timestamp"], TIMESTAMP_FORMAT)
+            latest = {
+                "time": row_time.strftime("%H:%M:%S"),
+                "red": float(sample["red"]),
+                "yellow": float(sample["yellow"]),
+                "green": float(sample["green"]),
+                "current": float(sample["current"]),
+                "timestamp": sample["timestamp"]
+            }
+        except (KeyError, TypeError, ValueError):
+            latest = None
+        if latest is not None:
+            if threshold <= row_time <= now:
+                return latest
+            # 最新値が古い＝ロガー停止中。CSV の方が新しくなければ走査しない
+            today_csv = os.path.join(ctx.data_dir, f"{now:%Y-%m-%d}.csv")
+            try:
+                if os.path.getmtime(today_csv) <= os.path.getmtime(ctx.latest_path):
+                    return None
+            except OSError:
+                return None
+
+    return _scan_latest_data(now, threshold, ctx.machine)
+
+def _scan_latest_data(now, threshold, machine=None):
+    """最新値ファイルが使えないときのフォールバック：過去5分に掛かる日の CSV を後ろから探す。"""
+    date_strs = sorted({threshold.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")}, reverse=True)
+    for date_str in date_strs:
+        day = get_day_data(date_str, machine)
+        if day is None:
             continue
-        filepath = os.path.join(DATA_DIR, filename)
-        with open(filepath, newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reversed(list(reader)):
-                try:
-                    row_time = datetime.strptime(f"{filename[:-4]} {row[0]}", "%Y-%m-%d %H:%M:%S")
-                except:
-                    continue
-                if threshold <= row_time <= now:
-                    return {
-                        "time": row[0],
-                        "red": float(row[1]),
-                        "yellow": float(row[2]),
-                        "green": float(row[3]),
-                        "current": float(row[4]),
-                        "timestamp": row_time.strftime("%Y-%m-%d %H:%M:%S")
-                    }
+        for i in reversed(range(len(day))):
+            if day.sec[i] == INVALID_SEC:
+                continue
+            row_time = day.day_start + timedelta(seconds=int(day.sec[i]))
+            if threshold <= row_time <= now:
+                return {
+                    "time": format_sec(day.sec[i]),
+                    "red": float(day.red[i]),
+                    "yellow": float(day.yellow[i]),
+                    "green": float(day.green[i]),
+                    "current": float(str(day.current[i])),  # float32 の表示桁に揃える
+                    "timestamp": row_time.strftime("%Y-%m-%d %H:%M:%S")
+                }
     return None
 
-def read_hinmoku_csv(date_str):
+def hinmoku_csv_path(date_str, machine=None):
+    """品目CSVの (ファイル名, パス)。"""
+    yyyymmdd = datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y%m%d")
+    expected_name = f"{machine or current_machine()}_{yyyymmdd}.csv"
+    return expected_name, os.path.join(DATA_DIR, HINMOKU_SUBDIR, expected_name)
+
+def read_hinmoku(date_str, machine=None):
+    """品目CSVのパース結果（HinmokuFile）。無い・空・読めなければ None。キャッシュ経由。"""
+    return hinmoku_cache.get(hinmoku_csv_path(date_str, machine)[1])
+
+def read_hinmoku_csv(date_str, machine=None):
     """
-    品目CSV: data/hinmoku/A214_YYYYMMDD_.csv を読み、(headers, rows) を返す。
+    品目CSV: data/hinmoku/<機械>_YYYYMMDD_.csv（既定は A214_...）を読み、(headers, rows) を返す。
     rows は 1行=リスト。1行目は見出し。
     文字コードは cp932 優先、失敗時に utf-8 にフォールバック。
     """
-    yyyymmdd = datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y%m%d")
-    expected_name = f"A214_{yyyymmdd}.csv"
-    dirpath = os.path.join(DATA_DIR, HINMOKU_SUBDIR)
-    filepath = os.path.join(dirpath, expected_name)
-
-    if not os.path.isdir(dirpath) or not os.path.exists(filepath):
-        return None, None, expected_name  # 見つからない
-
-    rows = []
-    # cp932 -> utf-8 の順でトライ
-    tried_encodings = ["cp932", "utf-8"]
-    last_err = None
-    for enc in tried_encodings:
-        try:
-            with open(filepath, newline="", encoding=enc) as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row:
-                        rows.append(row)
-            break
-        except Exception as e:
-            rows = []
-            last_err = e
-            continue
-
-    if not rows:
-        # 空 or 読めない
-        return None, None, expected_name
-
-    headers = rows[0]
-    records = rows[1:]
-    return headers, records, expected_name
+    expected_name, filepath = hinmoku_csv_path(date_str, machine)
+    hinmoku = hinmoku_cache.get(filepath)
+    if hinmoku is None:
+        return None, None, expected_name  # 見つからない・空・読めない
+    return hinmoku.headers, hinmoku.records, expected_name
 
 def set_japanese_font():
     """日本語フォント設定（存在すれば適用）"""
@@ -149,70 +217,30 @@ def set_japanese_font():
         plt.rcParams['font.family'] = fm.FontProperties(fname=font_path).get_name()
 
 
-def _day_range(date_str):
-    base_date = datetime.strptime(date_str, "%Y-%m-%d")
-    start = datetime.combine(base_date, datetime.strptime("00:00:00", "%H:%M:%S").time())
-    end   = start + timedelta(days=1)
-    return start, end
+def get_day_data(date_str, machine=None):
+    """機械の <date_str>.csv を読み込んだ DayData を返す（無ければ None）。キャッシュ経由。"""
+    return day_cache.get(machine_ctx(machine).data_dir, date_str)
 
 
-def _load_minute_colors(date_str, start_dt=None, end_dt=None, include_gray=True):
+def _load_timeline(day, start_dt=None, end_dt=None, include_gray=True):
     """
-    data/<date_str>.csv を読み、分単位の色辞書 {datetime: color} を返す。
-    start_dt/end_dt が指定されれば [start_dt, end_dt) にクリップして格納。
-    include_gray=False の場合は 'gray' を除外。
+    DayData から状態タイムライン（StateTimeline）を返す。
+    start_dt/end_dt が指定されれば [start_dt, end_dt) にクリップする。
+    include_gray=False の場合は 'gray'（不明）を除外。
     """
-    csv_path = os.path.join(DATA_DIR, f"{date_str}.csv")
-    if not os.path.exists(csv_path):
-        return None  # データなし
+    return day.timeline_between(start_dt=start_dt, end_dt=end_dt, include_gray=include_gray)
 
-    day_start, day_end = _day_range(date_str)
 
-    # クリップ（無指定なら一日分）
-    s = max(start_dt, day_start) if start_dt else day_start
-    e = min(end_dt,   day_end)   if end_dt   else day_end
-
-    minute_color = {}
-    with open(csv_path, newline='', encoding='utf-8') as f:
-        for row in csv.reader(f):
-            if len(row) < 5:
-                continue
-            try:
-                t = datetime.strptime(date_str + " " + row[0], "%Y-%m-%d %H:%M:%S")
-            except Exception:
-                continue
-
-            # クリップ範囲外は無視
-            if not (s <= t < e):
-                continue
-
-            try:
-                r, y, g, c = float(row[1]), float(row[2]), float(row[3]), float(row[4])
-                _, _, _, color = get_light_status(r, y, g, c)
-                if (color == "gray") and (not include_gray):
-                    continue
-                minute_color[t] = color
-            except Exception:
-                continue
-
-    return minute_color
-
-
-def _render_day_timeline(date_str, minute_color, out_png_path, title):
+def _render_day_timeline(day, timeline, out_png_path, title):
     """
-    1日横棒を描画。minute_color に入っている分だけ色を塗る。
+    1日横棒を描画。timeline のランごとに1本の棒で色を塗る。
     """
     set_japanese_font()
-    day_start, day_end = _day_range(date_str)
+    day_start, day_end = day.day_start, day.day_end
 
     plt.figure(figsize=(14, 2))
-    current = day_start
-    while current < day_end:
-        color = minute_color.get(current)
-        if color:
-            left = (current - day_start).total_seconds()
-            plt.barh(0, 60, left=left, height=0.5, color=color)
-        current += timedelta(minutes=1)
+    for start, length, color in timeline.color_runs():
+        plt.barh(0, length * 60, left=start * 60, height=0.5, color=color)
 
     # 目盛り（毎時）
     xticks, xticklabels = [], []
@@ -228,15 +256,16 @@ def _render_day_timeline(date_str, minute_color, out_png_path, title):
     plt.title(title)
     plt.tight_layout()
 
-    os.makedirs("static", exist_ok=True)
-    if os.path.exists(out_png_path):
-        os.remove(out_png_path)
-    plt.savefig(out_png_path)
+    # 一時ファイルに書いてから置き換える（書きかけの PNG を配信しない）
+    os.makedirs(os.path.dirname(out_png_path) or ".", exist_ok=True)
+    tmp_path = f"{out_png_path}.{os.getpid()}.tmp"
+    plt.savefig(tmp_path, format="png")
     plt.close()
+    os.replace(tmp_path, out_png_path)
 
 
 def generate_graph_image_unified(
-    date_str,
+    day,
     start_dt=None,
     end_dt=None,
     out_png_path=None,
@@ -244,15 +273,15 @@ def generate_graph_image_unified(
     skip_if_up_to_date=True,
 ):
     """
-    1本化された描画関数。
+    1本化された描画関数（day は DayData）。
     - 日全体: start_dt/end_dt を渡さない
     - 区間のみ: start_dt/end_dt を渡す（[start_dt, end_dt)）
     - out_png_path 未指定時はデイリーの既定パスを使う
     - デイリーはCSVが新しければ再描画、最新ならスキップ（skip_if_up_to_date=True）
     """
-    csv_path = os.path.join(DATA_DIR, f"{date_str}.csv")
-    if not os.path.exists(csv_path):
+    if day is None:
         return False
+    date_str = day.date_str
 
     # 既定の出力先
     if out_png_path is None:
@@ -262,39 +291,48 @@ def generate_graph_image_unified(
     # 「日全体」かつ「最新ならスキップ」だけ最適化
     is_full_day = (start_dt is None and end_dt is None)
     if skip_if_up_to_date and is_full_day and os.path.exists(out_png_path):
-        if os.path.getmtime(csv_path) <= os.path.getmtime(out_png_path):
+        if day.mtime <= os.path.getmtime(out_png_path):
             return True  # 画像が最新
 
-    # 分ごとの色割り当てを取得
-    minute_color = _load_minute_colors(
-        date_str,
+    # 状態タイムラインを取得
+    timeline = _load_timeline(
+        day,
         start_dt=start_dt,
         end_dt=end_dt,
         include_gray=include_gray
     )
-    if not minute_color:
+    if not timeline:
         return False
 
-    # タイトル
-    if is_full_day:
-        title = f"{date_str} 状態推移グラフ"
-    else:
-        # 表示は当日内の時刻だけで十分
-        s = start_dt.strftime("%H:%M")
-        e = end_dt.strftime("%H:%M")
-        title = f"{date_str} 品目時間帯グラフ（{s}〜{e}）"
-
-    _render_day_timeline(date_str, minute_color, out_png_path, title)
+    _render_day_timeline(day, timeline, out_png_path, _graph_title(day, start_dt, end_dt))
     return True
 
-def generate_graph_image(date):
+def _graph_title(day, start_dt=None, end_dt=None):
+    if start_dt is None and end_dt is None:
+        return f"{day.date_str} 状態推移グラフ"
+    # 表示は当日内の時刻だけで十分
+    s = start_dt.strftime("%H:%M")
+    e = end_dt.strftime("%H:%M")
+    return f"{day.date_str} 品目時間帯グラフ（{s}〜{e}）"
+
+def _intervals_title(day, intervals):
+    # タイトル：最初と最後の時刻を表示
+    s_label = intervals[0][0].strftime("%H:%M")
+    e_label = intervals[-1][1].strftime("%H:%M")
+    return f"{day.date_str} 品目時間帯グラフ（{s_label}〜{e_label}／{len(intervals)}区間）"
+
+def _merge_interval_timeline(day, intervals):
+    # 区間ごとに切り出したタイムラインの和集合（重なった分は1回だけ）
+    return day.timeline_for_intervals(intervals)
+
+def generate_graph_image(day):
     # 互換ラッパー：そのまま呼ばれても動くように
-    return generate_graph_image_unified(date_str=date)
+    return generate_graph_image_unified(day)
 
-def generate_graph_image_for_interval(date_str, start_dt, end_dt, out_png_path):
+def generate_graph_image_for_interval(day, start_dt, end_dt, out_png_path):
     # 互換ラッパー：include_gray のデフォルトはこれまでと同じ挙動（灰色も描画）
     return generate_graph_image_unified(
-        date_str=date_str,
+        day,
         start_dt=start_dt,
         end_dt=end_dt,
         out_png_path=out_png_path,
@@ -303,76 +341,127 @@ def generate_graph_image_for_interval(date_str, start_dt, end_dt, out_png_path):
         skip_if_up_to_date=False,
     )
 
-def generate_graph_image_for_intervals(date_str, intervals, out_png_path):
+def generate_graph_image_for_intervals(day, intervals, out_png_path):
     """
     複数区間の合成グラフを1枚に描画。
     """
-    if not intervals:
+    if day is None or not intervals:
         return False
 
-    # 分ごとの色を区間ごとに読み、ORマージ
-    merged = {}
-    for s_dt, e_dt in intervals:
-        mc = _load_minute_colors(date_str, start_dt=s_dt, end_dt=e_dt, include_gray=True)
-        if not mc:
-            continue
-        merged.update(mc)
-
+    merged = _merge_interval_timeline(day, intervals)
     if not merged:
         return False
 
-    # タイトル：最初と最後の時刻を表示
-    s_label = intervals[0][0].strftime("%H:%M")
-    e_label = intervals[-1][1].strftime("%H:%M")
-    title = f"{date_str} 品目時間帯グラフ（{s_label}〜{e_label}／{len(intervals)}区間）"
-
-    _render_day_timeline(date_str, merged, out_png_path, title)
+    _render_day_timeline(day, merged, out_png_path, _intervals_title(day, intervals))
     return True
 
+def day_timeline(day, intervals=None):
+    """状態タイムライン（StateTimeline）を返す（intervals 指定時はその区間だけ）。"""
+    if day is None:
+        return StateTimeline.empty()
+    return _merge_interval_timeline(day, intervals) if intervals else _load_timeline(day)
+
+def _render_png_job(out_png_path, machine, date_str, intervals=None):
+    """バックグラウンド描画ジョブ（render_worker のプロセス内で実行される）。"""
+    day = get_day_data(date_str, machine)
+    if intervals:
+        return generate_graph_image_for_intervals(day, intervals, out_png_path)
+    return generate_graph_image_unified(day, out_png_path=out_png_path)
+
+# 以前 static/ 直下に出していた日別・品目区間グラフ（置き場の上限の対象外なので消す）
+graph_cache = GraphCache(GRAPH_CACHE_DIR, max_bytes=GRAPH_CACHE_MAX_BYTES,
+                         legacy_patterns=("*_graph.png", "*_hinmoku_*.png"))
+render_worker = RenderWorker(_render_png_job, process_pool, on_rendered=graph_cache.added)
+# 描画済みページを返すときは、ページが参照するグラフ画像の LRU も更新する（消えていれば描き直す）
+page_cache = PageCache(max_bytes=PAGE_CACHE_MAX_BYTES, spill_dir=PAGE_CACHE_SPILL_DIR, touch=graph_cache.touch)
+_last_day_graphs = {}  # (機械, 日付) -> 最後に表示できた日別グラフのキー（描き直しの間に出す）
+
+def _day_graph_key(date_str, machine=None):
+    """日別グラフの graph_cache キー（センサーCSVの (サイズ, mtime) ごと）。CSV が無ければ None。"""
+    csv_path = os.path.join(machine_ctx(machine).data_dir, f"{date_str}.csv")
+    fingerprint = file_fingerprint(csv_path)
+    if fingerprint is None:
+        return None
+    return graph_cache.key(GRAPH_STYLE_VERSION, csv_path, *fingerprint)
+
+def _prerender_days(today):
+    # 日付が変わった直後：全機械の前日（確定）と当日の日別グラフを先に描いておく
+    for machine in list_machines(DATA_DIR):
+        for d in (today - timedelta(days=1), today):
+            date_str = d.strftime("%Y-%m-%d")
+            key = _day_graph_key(date_str, machine)
+            if key is not None and not os.path.exists(graph_cache.path(key)):
+                render_worker.submit(key, graph_cache.path(key), machine, date_str)
+
+def day_graph(date_str):
+    """
+    テンプレート用の日別グラフ {"svg": ..., "image_filename": ..., "pending": ...}。
+    GRAPH_FORMAT="svg" ならインラインSVG、"png" なら graph_cache の画像（CSV が変われば別の画像）。
+    今の CSV の画像が無ければバックグラウンドで描き、その間は前に出した画像を出す
+    （それも無ければ pending=True で「生成中」を表示）。描けなければ全部 None/False。
+    """
+    if GRAPH_FORMAT == "svg":
+        day = get_day_data(date_str)
+        timeline = day_timeline(day)
+        return {"svg": render_svg(timeline, _graph_title(day)) if timeline else None,
+                "image_filename": None, "pending": False}
+
+    machine = current_machine()
+    key = _day_graph_key(date_str)
+    if key is None:
+        return {"svg": None, "image_filename": None, "pending": False}
+    if graph_cache.get(key):
+        _last_day_graphs[(machine, date_str)] = key
+        page_uses(key)
+        return {"svg": None, "image_filename": graph_cache.filename(key), "pending": False}
+
+    render_worker.start_daily(_prerender_days)
+    render_worker.submit(key, graph_cache.path(key), machine, date_str)
+    no_store()
+    old = _last_day_graphs.get((machine, date_str))
+    if old is not None and graph_cache.get(old):
+        return {"svg": None, "image_filename": graph_cache.filename(old), "pending": False}
+    return {"svg": None, "image_filename": None, "pending": True}
+
+def intervals_graph(day, intervals):
+    """
+    テンプレート用の品目区間グラフ（day_graph と同じ形式）。
+    PNG は graph_cache から（CSV と区間の組が同じなら行・日をまたいで同じ画像）。
+    無ければバックグラウンドで描き、その間は pending=True。
+    """
+    if GRAPH_FORMAT == "svg":
+        timeline = day_timeline(day, intervals) if intervals else StateTimeline.empty()
+        return {"svg": render_svg(timeline, _intervals_title(day, intervals)) if timeline else None,
+                "image_filename": None, "pending": False}
+
+    if day is None or not intervals:
+        return {"svg": None, "image_filename": None, "pending": False}
+    key = graph_cache.key(
+        GRAPH_STYLE_VERSION, day.csv_path, day.size, day.mtime_ns,
+        tuple((s.isoformat(), e.isoformat()) for s, e in intervals))
+    if graph_cache.get(key):
+        page_uses(key)
+        return {"svg": None, "image_filename": graph_cache.filename(key), "pending": False}
+    render_worker.submit(key, graph_cache.path(key), current_machine(), day.date_str, intervals)
+    no_store()
+    return {"svg": None, "image_filename": None, "pending": True}
+
 
 # --- 追記: 柔軟な日時パーサ（秒あり/なしを許容） ---
 def parse_flexible_dt(s):
     """
     "YYYY/M/D H:M[:S]" 形式（ゼロ詰め無しOK、秒あり/なし両対応）を受け付けて datetime を返す。
     例: "2025/8/4 8:46", "2025/08/04 08:46:13"
+    よくある形は fast_time で strptime を使わずに読む（結果は従来と同じ）。
     """
-    s = s.strip()
-    fmts = [
-        "%Y/%m/%d %H:%M:%S",
-        "%Y/%m/%d %H:%M",
-        "%Y/%-m/%-d %-H:%-M:%-S",  # Linux系のゼロ無し。Windowsでは無視されるが例として残す
-        "%Y/%-m/%-d %-H:%-M",
-    ]
-    for fmt in fmts:
-        try:
-            return datetime.strptime(s, fmt)
-        except Exception:
-            continue
-    # 上の %- 指定は環境依存。最後に標準的な置換で再トライ
-    try:
-        # ゼロ詰めして秒なしをまず試す
-        parts = s.replace("/", " ").replace(":", " ").split()
-        # ["YYYY","M","D","H","M"(,"S")]
-        if len(parts) >= 5:
-            Y, M, D, h, m = parts[:5]
-            sec = parts[5] if len(parts) >= 6 else "00"
-            canon = f"{int(Y):04d}/{int(M):02d}/{int(D):02d} {int(h):02d}:{int(m):02d}:{int(sec):02d}"
-            return datetime.strptime(canon, "%Y/%m/%d %H:%M:%S")
-    except Exception:
-        pass
-    raise ValueError("日時の形式が不正です")
+    return fast_time.parse_flexible_dt(s)
 
-def extract_intervals_from_row(date_str, row):
+def parse_row_times(row):
     """
-    新CSV1行から最大5つの区間[(start_dt, end_dt), ...]を返す。
+    新CSV1行の [(開始, 停止 or None), ...]（最大5組）。日時のパースだけで、当日へのクリップはしない。
     列: 9=開始1,10=停止1, 11=開始2,12=停止2, ..., 17=開始5,18=停止5
     """
-    base_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-    day_start = datetime.combine(base_date, time(0, 0, 0))
-    day_end   = datetime.combine(base_date, time(23, 59, 59))
-    now = datetime.now()
-
-    intervals = []
+    pairs = []
     # 5ペアを走査
     for i in range(5):
         s_idx = 9 + 2*i
@@ -391,13 +480,26 @@ def extract_intervals_from_row(date_str, row):
         except Exception:
             continue
 
-        # 停止の補完
         e_dt = None
         if e_raw:
             try:
                 e_dt = parse_flexible_dt(e_raw)
             except Exception:
                 e_dt = None
+        pairs.append((s_dt, e_dt))
+    return pairs
+
+def resolve_intervals(date_str, pairs, now=None):
+    """parse_row_times の結果を当日の区間 [(start_dt, end_dt), ...]（時刻順）にする。"""
+    base_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    day_start = datetime.combine(base_date, time(0, 0, 0))
+    day_end   = datetime.combine(base_date, time(23, 59, 59))
+    if now is None:
+        now = datetime.now()
+
+    intervals = []
+    for s_dt, e_dt in pairs:
+        # 停止の補完
         if e_dt is None:
             e_dt = min(now, day_end) if base_date == now.date() else day_end
 
@@ -416,6 +518,29 @@ def extract_intervals_from_row(date_str, row):
     intervals.sort(key=lambda t: t[0])
     return intervals
 
+def extract_intervals_from_row(date_str, row):
+    """
+    新CSV1行から最大5つの区間[(start_dt, end_dt), ...]を返す。
+    列: 9=開始1,10=停止1, 11=開始2,12=停止2, ..., 17=開始5,18=停止5
+    """
+    return resolve_intervals(date_str, parse_row_times(row))
+
+def hinmoku_intervals(date_str, hinmoku, now=None):
+    """
+    品目CSVの全行の区間リスト（records と同じ順）。時刻のパースは hinmoku_cache で済んでいる。
+    当日以外は now に依らないので、結果を hinmoku に覚えておく。
+    """
+    if now is None:
+        now = datetime.now()
+    if hinmoku.resolved is not None:
+        return hinmoku.resolved
+    resolved = [resolve_intervals(date_str, pairs, now) for pairs in hinmoku.row_times]
+    if date_str != now.strftime("%Y-%m-%d"):
+        hinmoku.resolved = resolved
+    return resolved
+
+hinmoku_cache = HinmokuCache(parse_row=parse_row_times)  # 全機械で共用（キーはパス）
+
 
 def resolve_item_interval(date_str, start_raw, end_raw):
     """
@@ -454,22 +579,20 @@ def resolve_item_interval(date_str, start_raw, end_raw):
 
     return start_dt, end_dt
 
-def get_current_processing_items(now=None):
+def get_current_processing_items(now=None, machine=None):
     if now is None:
         now = datetime.now()
     today_str = now.strftime("%Y-%m-%d")
 
-    headers, records, expected_name = read_hinmoku_csv(today_str)
+    expected_name = hinmoku_csv_path(today_str, machine)[0]
+    hinmoku = read_hinmoku(today_str, machine)
     result = {"has_csv": False, "expected": expected_name, "items": []}
-    if not headers or records is None:
+    if hinmoku is None:
         return result
     result["has_csv"] = True
 
-    for idx, row in enumerate(records, start=1):
-        if len(row) < 19:  # 最低でも停止5までの列がある想定
-            # 多少短いCSVでも、開始1(9)があれば動くように下限は緩くしてもOK
-            pass
-        intervals = extract_intervals_from_row(today_str, row)
+    all_intervals = hinmoku_intervals(today_str, hinmoku, now)
+    for idx, (row, intervals) in enumerate(zip(hinmoku.records, all_intervals), start=1):
         if not intervals:
             continue
 
@@ -497,123 +620,129 @@ def get_current_processing_items(now=None):
 
 
 # --- 追記: 区間限定の状態別集計ユーティリティ ---
-def summarize_states_for_interval(date_str, start_dt, end_dt):
+def summarize_states_for_interval(day, start_dt, end_dt):
     """
-    data/<date_str>.csv の 1分単位データを読み、[start_dt, end_dt) の区間だけ
+    DayData の 1分単位データから [start_dt, end_dt) の区間だけ
     状態別合計秒数を算出して返す（dict: state -> 秒）。
     区間が当日の 0:00〜24:00 をはみ出していれば当日内にクリップする。
     """
-    csv_path = os.path.join(DATA_DIR, f"{date_str}.csv")
-    if not os.path.exists(csv_path):
+    if day is None:
         return None  # データなし
+    return day.state_seconds(start_dt, end_dt)  # 1行=1分
 
-    base_date = datetime.strptime(date_str, "%Y-%m-%d")
-    day_start = datetime.combine(base_date, datetime.strptime("00:00:00", "%H:%M:%S").time())
-    day_end   = day_start + timedelta(days=1)
-
-    # クリップ
-    s = max(start_dt, day_start)
-    e = min(end_dt,   day_end)
-    if not (s < e):
-        # 重なりなし
-        return {k: 0 for k in ["加工中", "手動加工中", "加工完了", "アラーム", "不明"]}
-
-    states = ["加工中", "手動加工中", "加工完了", "アラーム", "不明"]
-    secs = {state: 0 for state in states}
-
-    with open(csv_path, newline="", encoding="utf-8") as f:
-        for row in csv.reader(f):
-            if len(row) < 5:
-                continue
-            try:
-                t = datetime.strptime(date_str + " " + row[0], "%Y-%m-%d %H:%M:%S")
-            except Exception:
-                # 時刻列が壊れている行はスキップ
-                continue
-
-            if not (s <= t < e):
-                continue
-
-            try:
-                r, y, g, c = float(row[1]), float(row[2]), float(row[3]), float(row[4])
-                _, _, state, _ = get_light_status(r, y, g, c)
-                secs[state] += 60  # 1分分加算
-            except Exception:
-                continue
-
-    return secs
-
-def summarize_states_for_intervals(date_str, intervals):
+def summarize_states_for_intervals(day, intervals):
     """
     複数区間の合計（状態別・秒）を返す。
     """
     if not intervals:
-        return {k: 0 for k in ["加工中", "手動加工中", "加工完了", "アラーム", "不明"]}
-    total = {k: 0 for k in ["加工中", "手動加工中", "加工完了", "アラーム", "不明"]}
+        return {k: 0 for k in STATES}
+    total = {k: 0 for k in STATES}
     for s_dt, e_dt in intervals:
-        secs = summarize_states_for_interval(date_str, s_dt, e_dt)
+        secs = summarize_states_for_interval(day, s_dt, e_dt)
         if secs is None:
             continue
         for k, v in secs.items():
             total[k] += v
     return total
 
-def generate_graph_image_for_intervals(date_str, intervals, out_png_path):
+def summarize_states_full_day_hours(day):
     """
-    複数区間の合成グラフを1枚に描画。
+    DayData の日全体（24h）の状態別合計時間（h）を小数2桁で返す。
+    データが無ければ None。
     """
-    if not intervals:
-        return False
-
-    # 分ごとの色を区間ごとに読み、ORマージ
-    merged = {}
-    for s_dt, e_dt in intervals:
-        mc = _load_minute_colors(date_str, start_dt=s_dt, end_dt=e_dt, include_gray=True)
-        if not mc:
-            continue
-        merged.update(mc)
-
-    if not merged:
-        return False
+    if day is None:
+        return None
+    secs = day.state_seconds()
+    return {k: round(v/3600.0, 2) for k, v in secs.items()}
 
-    # タイトル：最初と最後の時刻を表示
-    s_label = intervals[0][0].strftime("%H:%M")
-    e_label = intervals[-1][1].strftime("%H:%M")
-    title = f"{date_str} 品目時間帯グラフ（{s_label}〜{e_label}／{len(intervals)}区間）"
+def get_live_status(machine=None):
+    """ライト/電流の最新値（過去5分）を表示用 dict で返す。無ければ None。"""
+    latest = get_latest_data(machine)
+    if not latest:
+        return None
+    lights, machine_action, state, color = get_light_status(
+        latest["red"], latest["yellow"], latest["green"], latest["current"])
+    return {
+        **lights,
+        "current": latest["current"],
+        "timestamp": latest["timestamp"],
+        "machine_action": machine_action,
+        "state": state,
+        "color": color
+    }
 
-    _render_day_timeline(date_str, merged, out_png_path, title)
-    return True
+def _live_sources(machine):
+    """
+    /events を更新するきっかけ：最新値ファイルと当日の品目CSVの (サイズ, mtime)、それと現在の分
+    （ファイルが変わらなくても、5分で最新値が古くなる・加工中の区間が伸びるので1分ごとには見直す）
+    """
+    now = datetime.now()
+    return (
+        now.strftime("%Y-%m-%d %H:%M"),
+        file_fingerprint(machine_ctx(machine).latest_path),
+        file_fingerprint(hinmoku_csv_path(now.strftime("%Y-%m-%d"), machine)[1]),
+    )
 
-def summarize_states_full_day_hours(date_str):
+def _live_snapshot(machine):
     """
-    data/<date_str>.csv を読み、日全体（24h）の状態別合計時間（h）を小数2桁で返す。
-    データが無ければ None。
+    /events 用のデータ（機械ごと）。前回と変わったイベントだけ _live_render で HTML にして配信される。
+    sample: 最新サンプルと状態判定、work: 当日の日付と現在加工中の品目
     """
-    csv_path = os.path.join(DATA_DIR, f"{date_str}.csv")
-    if not os.path.exists(csv_path):
-        return None
-    states = ["加工中", "手動加工中", "加工完了", "アラーム", "不明"]
-    secs = {s: 0 for s in states}
-    with open(csv_path, newline='', encoding='utf-8') as f:
-        for row in csv.reader(f):
-            if len(row) < 5:
-                continue
-            try:
-                r, y, g, c = float(row[1]), float(row[2]), float(row[3]), float(row[4])
-                _, _, state, _ = get_light_status(r, y, g, c)
-                secs[state] += 60
-            except Exception:
-                continue
-    return {k: round(v/3600.0, 2) for k, v in secs.items()}
+    now = datetime.now()
+    return {
+        "sample": get_live_status(machine),
+        "work": (now.strftime("%Y-%m-%d"), get_current_processing_items(now=now, machine=machine)),
+    }
+
+def _live_render(machine, name, data):
+    """_live_snapshot のイベント1つを配信用のペイロード（各カードの HTML 付き）にする。"""
+    with app.app_context():
+        if name == "sample":
+            html = render_template(
+                "index/status_card.html",
+                status=data,
+                thresholds=THRESHOLDS,
+                current_threshold=CURRENT_THRESHOLD
+            )
+            return {"status": data, "html": html}
+        today_str, current_work = data
+        html = render_template(
+            "index/current_work.html", current_work=current_work, today=today_str,
+            machine_prefix=machine_ctx(machine).url_prefix)
+        return {"items": [it["index"] for it in current_work["items"]], "html": html}
+
+@app.route("/events")
+def stream_events():
+    """ダッシュボードのライブ更新（Server-Sent Events）。接続直後に現在の状態を送る。"""
+    live_notifier = machine_ctx().live_notifier
+
+    def generate():
+        # 接続している間だけ購読する（全員切断すれば監視スレッドは止まる）
+        live_notifier.subscribe()
+        try:
+            since = 0
+            while True:
+                events = live_notifier.wait(since, timeout=15)
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                for version, name, data in events:
+                    since = max(since, version)
+                    payload = json.dumps(data, ensure_ascii=False)
+                    yield f"id: {version}\nevent: {name}\ndata: {payload}\n\n"
+        finally:
+            live_notifier.unsubscribe()
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.route("/")
 def index():
     # --- ライト/電流の最新値（過去5分） ---
-    latest = get_latest_data()
-    status = {}
-    if latest:
-        lights, _, _, _ = get_light_status(latest["red"], latest["yellow"], latest["green"], latest["current"])
-        status = {**lights, "current": latest["current"], "timestamp": latest["timestamp"]}
+    status = get_live_status()
 
     # --- 右カラム：現在の加工状況（今日のhinmoku）---
     now = datetime.now()
@@ -621,63 +750,66 @@ def index():
     today_str = now.strftime("%Y-%m-%d")
 
     # --- 年度カレンダー（4月～翌年3月） ---
-    if now.month >= 4:
-        fiscal_start = datetime(now.year, 4, 1)
-    else:
-        fiscal_start = datetime(now.year - 1, 4, 1)
-    fiscal_end = fiscal_start.replace(year=fiscal_start.year + 1) - timedelta(days=1)
-
-    # 存在するCSV日付・月の判定
-    existing_days = set()
-    existing_months = set()
-    for fname in os.listdir(DATA_DIR):
-        if fname.endswith(".csv"):
-            try:
-                date_obj = datetime.strptime(fname[:-4], "%Y-%m-%d")
-                if fiscal_start <= date_obj <= fiscal_end:
-                    existing_days.add(date_obj.date())
-                    existing_months.add(date_obj.strftime("%Y-%m"))
-            except:
-                continue
-
-    # カレンダーデータ構築
-    calendar = {}
-    current = fiscal_start
-    while current <= fiscal_end:
-        ym = current.strftime("%Y-%m")
-        if ym not in calendar:
-            calendar[ym] = {
-                "month_link": ym in existing_months,
-                "weeks": [[]]
-            }
-
-        week = calendar[ym]["weeks"][-1]
-        if len(week) == 0 and current.weekday() != 0:
-            week.extend([None] * current.weekday())
-
-        week.append({
-            "day": current.day,
-            "date": current.strftime("%Y-%m-%d"),
-            "link": current.date() in existing_days
-        })
-
-        if current.weekday() == 6:
-            calendar[ym]["weeks"].append([])
-
-        current += timedelta(days=1)
+    fiscal_year = fiscal_year_of(now)
+    calendar = fiscal_calendar(fiscal_year)
 
     return render_template(
         "index.html",
-        status=(status if latest else None),
+        status=status,
         thresholds=THRESHOLDS,
         current_threshold=CURRENT_THRESHOLD,
         calendar=calendar,
         current_work=current_work,
-        today=today_str
+        today=today_str,
+        fiscal_year=fiscal_year
     )
 
 
+def _is_final(last_date):
+    """last_date（その日・その月の最終日）から FINAL_AFTER_DAYS 日以上経っていれば確定"""
+    return last_date <= datetime.now().date() - timedelta(days=FINAL_AFTER_DAYS)
+
+def _max_age(last_date):
+    return FINAL_MAX_AGE_SEC if _is_final(last_date) else CURRENT_MAX_AGE_SEC
+
+def _date_fingerprint(date, **_):
+    """/date/<date>/... の ETag の元：センサーCSVと品目CSVの (サイズ, mtime)"""
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    parts = (
+        GRAPH_FORMAT,
+        file_fingerprint(os.path.join(machine_ctx().data_dir, f"{date}.csv")),
+        file_fingerprint(hinmoku_csv_path(date)[1]),
+    )
+    return parts, _max_age(day), _is_final(day)
+
+def _month_fingerprint(year_month):
+    """/month/<year_month>/... の ETag の元：その月のセンサーCSVすべての (サイズ, mtime)"""
+    try:
+        first = datetime.strptime(year_month, "%Y-%m").date()
+    except ValueError:
+        return None
+    data_dir = machine_ctx().data_dir
+    parts = (GRAPH_FORMAT,) + tuple(
+        (d, file_fingerprint(os.path.join(data_dir, f"{d}.csv")))
+        for d in machine_ctx().day_index.dates_in_month(year_month)
+    )
+    last = first.replace(day=monthrange(first.year, first.month)[1])
+    return parts, _max_age(last), _is_final(last)
+
+@app.after_request
+def static_cache_control(resp):
+    # static/graphs/ の画像は名前ごとに内容が変わらないので長く
+    if request.endpoint == "static" and resp.status_code in (200, 304):
+        filename = (request.view_args or {}).get("filename", "")
+        if filename.startswith("graphs/"):
+            resp.headers["Cache-Control"] = f"public, max-age={GRAPH_CACHE_MAX_AGE_SEC}, immutable"
+    return resp
+
 @app.route("/month/<year_month>/overview")
+@conditional(_month_fingerprint, page_cache)
 def show_month_overview(year_month):
     """月俯瞰：2列（左=日別サマリ、右=日別グラフ）、DD_MAX行"""
     try:
@@ -689,60 +821,47 @@ def show_month_overview(year_month):
     month = target_month.month
     dd_max = monthrange(year, month)[1]
 
+    # 日別集計は月分まとめて取得（作り直しが要る日は並列に集計）
+    date_strs = [f"{year_month}-{day:02d}" for day in range(1, dd_max + 1)]
+    rollups = machine_ctx().rollup_store.get_days(date_strs)
+
     items = []
-    for day in range(1, dd_max + 1):
-        date_str = f"{year_month}-{day:02d}"
-        csv_path = os.path.join(DATA_DIR, f"{date_str}.csv")
+    for date_str in date_strs:
+        rollup = rollups.get(date_str)
 
         durations = None
-        image_filename = None
+        graph = {"svg": None, "image_filename": None, "pending": False}
 
-        if os.path.exists(csv_path):
-            # 左列：日別サマリ（時間）
-            durations = summarize_states_full_day_hours(date_str)  # dict or None（通常はdict）
-            # 右列：日別グラフ
-            generate_graph_image(date_str)  # 既存ならスキップ
-            image_filename = f"{date_str}_graph.png"
+        if rollup is not None:
+            # 左列：日別サマリ（時間）。日別集計テーブルから読む
+            durations = {k: round(v/3600.0, 2) for k, v in state_seconds_of(rollup).items()}
+            # 右列：日別グラフ（PNG は古ければバックグラウンドで描き直し）
+            graph = day_graph(date_str)
 
         items.append({
             "date": date_str,
             "durations": durations,          # None のときは「データなし」を表示
-            "image_filename": image_filename # None のときは「グラフなし」を表示
+            **graph                          # svg / image_filename が None のときは「グラフなし」（pending なら「生成中」）を表示
         })
 
     return render_template("month/overview.html", year_month=year_month, items=items)
 
 @app.route("/month/<year_month>/graph")
+@conditional(_month_fingerprint, page_cache)
 def show_month_graph(year_month):
     try:
         month_date = datetime.strptime(year_month, "%Y-%m")
     except:
         abort(404)
 
-    year = month_date.year
-    month = month_date.month
-    day = 1
     images = []
 
-    while True:
-        try:
-            current_date = datetime(year, month, day)
-        except:
-            break
-        date_str = current_date.strftime("%Y-%m-%d")
-        csv_path = os.path.join(DATA_DIR, f"{date_str}.csv")
-        image_filename = f"{date_str}_graph.png"
-        image_path = os.path.join("static", image_filename)
-
-        # 存在するCSVファイルについてのみ描画
-        if os.path.exists(csv_path):
-            generate_graph_image(date_str)
-            images.append({
-                "date": date_str,
-                "image_filename": image_filename
-            })
-
-        day += 1
+    # 存在するCSVファイルについてのみ描画（PNG は古ければバックグラウンドで描き直し）
+    for date_str in machine_ctx().day_index.dates_in_month(month_date.strftime("%Y-%m")):
+        images.append({
+            "date": date_str,
+            **day_graph(date_str)
+        })
 
     if not images:
         abort(404)
@@ -751,41 +870,25 @@ def show_month_graph(year_month):
 
 
 @app.route("/month/<year_month>/summary")
+@conditional(_month_fingerprint, page_cache)
 def show_month_summary(year_month):
     try:
         target_month = datetime.strptime(year_month, "%Y-%m")
     except ValueError:
         abort(404)
 
-    states = ["加工中", "手動加工中", "加工完了", "アラーム", "不明"]
+    states = STATES
     summaries = {state: [] for state in states}
     labels = []
 
-    # 該当月の .csv だけを処理（ファイル名=YYYY-MM-DD.csv）
-    for fname in sorted(os.listdir(DATA_DIR)):
-        if not fname.endswith(".csv"):
-            continue
-        try:
-            date_obj = datetime.strptime(fname[:-4], "%Y-%m-%d")
-        except ValueError:
-            continue
-        if date_obj.strftime("%Y-%m") != year_month:
-            continue
+    # 該当月の .csv だけを処理（日付一覧は day_index から）
+    ctx = machine_ctx()
+    date_strs = ctx.day_index.dates_in_month(target_month.strftime("%Y-%m"))
 
-        labels.append(date_obj.strftime("%Y-%m-%d"))
-        filepath = os.path.join(DATA_DIR, fname)
-        durations_sec = {state: 0 for state in states}
-
-        with open(filepath, newline='', encoding='utf-8') as f:
-            for row in csv.reader(f):
-                if len(row) < 5:
-                    continue
-                try:
-                    r, y, g, c = float(row[1]), float(row[2]), float(row[3]), float(row[4])
-                    _, _, state, _ = get_light_status(r, y, g, c)
-                    durations_sec[state] += 60  # 1分粒度
-                except:
-                    continue
+    # 日別集計をまとめて取得（作り直しが要る日は並列に集計）
+    for date_str, rollup in ctx.rollup_store.get_days(date_strs).items():
+        labels.append(date_str)
+        durations_sec = state_seconds_of(rollup)  # 1分粒度（日別集計テーブルから）
 
         # 時間(h)に変換して格納
         for state in states:
@@ -821,7 +924,117 @@ def show_month_summary(year_month):
         grand_total=grand_total,
     )
 
+def fiscal_year_of(d):
+    """d が属する年度（4月始まり。2025年4月〜2026年3月は 2025）"""
+    return d.year if d.month >= 4 else d.year - 1
+
+def fiscal_year_range(year):
+    """年度の (開始日, 終了日) を datetime で返す（4/1〜翌年3/31）"""
+    start = datetime(year, 4, 1)
+    return start, start.replace(year=year + 1) - timedelta(days=1)
+
+def fiscal_calendar(year):
+    """
+    年度カレンダー {"YYYY-MM": {"month_link", "weeks"}} を返す。
+    CSV の日付一覧（day_index）が変わらない限り前回作ったものを使い回す。
+    """
+    ctx = machine_ctx()
+    version, _, existing = ctx.day_index.snapshot()
+    cached = ctx.calendar_cache.get(year)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    fiscal_start, fiscal_end = fiscal_year_range(year)
+    existing_months = {d[:7] for d in ctx.day_index.dates_between(f"{fiscal_start:%Y-%m-%d}", f"{fiscal_end:%Y-%m-%d}")}
+
+    # カレンダーデータ構築
+    calendar = {}
+    current = fiscal_start
+    while current <= fiscal_end:
+        ym = current.strftime("%Y-%m")
+        if ym not in calendar:
+            calendar[ym] = {
+                "month_link": ym in existing_months,
+                "weeks": [[]]
+            }
+
+        week = calendar[ym]["weeks"][-1]
+        if len(week) == 0 and current.weekday() != 0:
+            week.extend([None] * current.weekday())
+
+        date_str = current.strftime("%Y-%m-%d")
+        week.append({
+            "day": current.day,
+            "date": date_str,
+            "link": date_str in existing
+        })
+
+        if current.weekday() == 6:
+            calendar[ym]["weeks"].append([])
+
+        current += timedelta(days=1)
+
+    ctx.calendar_cache[year] = (version, calendar)
+    return calendar
+
+def _hours_table(period_rows):
+    """[(キー, {state: 秒}), ...] を表示用の [{"key", "hours", "total"}, ...]（時間）にする。"""
+    table = []
+    for key, secs in period_rows:
+        hours = {state: round(secs[state] / 3600, 2) for state in STATES}
+        table.append({"key": key, "hours": hours, "total": round(sum(hours.values()), 2)})
+    return table
+
+@app.route("/range/<from_date>/<to_date>/summary")
+def show_range_summary(from_date, to_date):
+    """期間（両端含む）の状態別稼動時間を日別・週別・月別に集計（日別集計テーブルから）。"""
+    try:
+        start = datetime.strptime(from_date, "%Y-%m-%d")
+        end = datetime.strptime(to_date, "%Y-%m-%d")
+    except ValueError:
+        abort(404)
+    if start > end:
+        abort(400, description="期間の開始日が終了日より後になっています。")
+    if (end - start).days >= RANGE_SUMMARY_MAX_DAYS:
+        abort(400, description=f"期間は {RANGE_SUMMARY_MAX_DAYS} 日以内で指定してください。")
+
+    # 期間内の日別集計を最新化（CSV が変わった日・未集計の日だけ作り直す）。
+    # 対象は CSV のある日だけ（day_index から）。CSV が消えた日の行は集計から外す
+    first, last = f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}"
+    ctx = machine_ctx()
+    date_strs = ctx.day_index.dates_between(first, last)
+    rollup_store = ctx.rollup_store
+    rollup_store.forget_missing(first, last, date_strs)
+    if not rollup_store.get_days(date_strs):
+        abort(404, description="指定された期間にデータが見つかりませんでした")
+
+    tables = {
+        period: _hours_table(rollup_store.state_seconds_by_period(first, last, period))
+        for period in ("month", "week", "day")
+    }
+    totals = rollup_store.state_seconds_between(first, last)
+    total_hours = {state: round(totals[state] / 3600, 2) for state in STATES}
+
+    return render_template(
+        "range/summary.html",
+        from_date=from_date,
+        to_date=to_date,
+        states=STATES,
+        tables=tables,
+        total_hours=total_hours,
+        grand_total=round(sum(total_hours.values()), 2),
+    )
+
+@app.route("/fiscal/<int:year>/summary")
+def show_fiscal_summary(year):
+    """年度（4/1〜翌年3/31）の期間集計へのショートカット"""
+    if not 1 <= year <= 9998:
+        abort(404)
+    start, end = fiscal_year_range(year)
+    return redirect(f"{machine_ctx().url_prefix}/range/{start:%Y-%m-%d}/{end:%Y-%m-%d}/summary")
+
 @app.route("/date/<date>/overview")
+@conditional(_date_fingerprint, page_cache)
 def show_date_overview(date):
     try:
         datetime.strptime(date, "%Y-%m-%d")
@@ -830,9 +1043,8 @@ def show_date_overview(date):
 
     items = []
     # 行1（日全体）
-    day_img = f"{date}_graph.png"
-    generate_graph_image_unified(date_str=date, out_png_path=os.path.join("static", day_img))
-    day_durations = summarize_states_full_day_hours(date)
+    day = get_day_data(date)
+    day_durations = summarize_states_full_day_hours(day)
     if day_durations is None:
         abort(404, description=f"{date}.csv が見つかりません。")
     items.append({
@@ -840,25 +1052,22 @@ def show_date_overview(date):
         "index": None,
         "info": None,
         "durations": day_durations,
-        "image_filename": day_img
+        **day_graph(date)
     })
 
     # 品目列（新CSV：状態＋開始/停止×5）
-    headers, records, _ = read_hinmoku_csv(date)
-    if headers and records:
-        for idx, row in enumerate(records, start=1):
-            intervals = extract_intervals_from_row(date, row)
+    hinmoku = read_hinmoku(date)
+    if hinmoku is not None and hinmoku.records:
+        for idx, (row, intervals) in enumerate(zip(hinmoku.records, hinmoku_intervals(date, hinmoku)), start=1):
             if not intervals:
                 continue
 
             # 状態別集計（時間）
-            secs = summarize_states_for_intervals(date, intervals)
+            secs = summarize_states_for_intervals(day, intervals)
             durations_hours = {k: round(v / 3600.0, 2) for k, v in secs.items()}
 
-            # 画像（複数区間）
-            img_name = f"{date}_hinmoku_{idx}.png"
-            ok = generate_graph_image_for_intervals(date, intervals, os.path.join("static", img_name))
-            image_filename = img_name if ok else None
+            # グラフ（複数区間）
+            graph = intervals_graph(day, intervals)
 
             intervals_str = " / ".join(f"{s.strftime('%H:%M')}-{e.strftime('%H:%M')}" for s, e in intervals)
 
@@ -875,18 +1084,20 @@ def show_date_overview(date):
                     "intervals": intervals_str,
                 },
                 "durations": durations_hours,
-                "image_filename": image_filename
+                **graph
             })
 
     year_month = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m")
     return render_template("date/overview.html", date=date, year_month=year_month, items=items)
     
 @app.route("/date/<date>/table")
+@conditional(_date_fingerprint, page_cache)
 def show_table(date):
     filename = f"{date}.csv"
-    filepath = os.path.join(DATA_DIR, filename)
+    filepath = os.path.join(machine_ctx().data_dir, filename)
     if not os.path.exists(filepath):
         abort(404)
+    # 生データ表示なので CSV の文字列をそのまま出す（サイドカーは float32 で桁が落ちるため使わない）
     rows = []
     with open(filepath, newline='', encoding='utf-8') as f:
         for row in csv.reader(f):
@@ -905,69 +1116,61 @@ def show_table(date):
     return render_template("date/sensor_data_list.html", date=date,year_month=year_month, rows=rows)
 
 @app.route("/date/<date>/status")
+@conditional(_date_fingerprint, page_cache)
 def show_status_table(date):
-    filename = f"{date}.csv"
-    filepath = os.path.join(DATA_DIR, filename)
-    if not os.path.exists(filepath):
+    day = get_day_data(date)
+    if day is None:
         abort(404)
+    # 時刻は CSV に書かれたままの文字列を出す（読めない時刻もそのまま）。
+    # 当日分で CSV が読み込み後に伸びていても、先頭から同じ行が並ぶ
+    time_texts = read_time_texts(day.csv_path)
     rows = []
-    with open(filepath, newline='', encoding='utf-8') as f:
-        for row in csv.reader(f):
-            if len(row) < 5:
-                continue
-            red, yellow, green, current = float(row[1]), float(row[2]), float(row[3]), float(row[4])
-            lights, machine_action, state, color = get_light_status(red, yellow, green, current)
-            rows.append({
-                "time": row[0],
-                "red": lights["red"],
-                "yellow": lights["yellow"],
-                "green": lights["green"],
-                "machine_action": machine_action,
-                "state": state,
-                "color": color
-            })
+    for i, (sec, code, state) in enumerate(zip(day.sec, day.light_codes, day.codes)):
+        rows.append({
+            "time": time_texts[i] if i < len(time_texts) else format_sec(sec),
+            "red": "点灯" if code & 0b1000 else "消灯",
+            "yellow": "点灯" if code & 0b0100 else "消灯",
+            "green": "点灯" if code & 0b0010 else "消灯",
+            "machine_action": "加工中" if code & 0b0001 else "加工なし",
+            "state": STATES[state],
+            "color": STATE_COLORS[state]
+        })
 
     year_month = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m")
     return render_template("date/status_list.html", date=date,year_month=year_month, rows=rows)
 
 @app.route("/date/<date>/graph")
+@conditional(_date_fingerprint, page_cache)
 def show_graph(date):
-    image_filename = f"{date}_graph.png"
-    image_path = os.path.join("static", image_filename)
-
-    csv_path = os.path.join(DATA_DIR, f"{date}.csv")
-    if not os.path.exists(csv_path):
+    if not os.path.exists(os.path.join(machine_ctx().data_dir, f"{date}.csv")):
         abort(404)
 
-    # グラフ生成（既存ならスキップ）
-    generate_graph_image(date)
-
-    if not os.path.exists(image_path):
+    # グラフ生成（PNG は古ければバックグラウンドで描き直し）
+    graph = day_graph(date)
+    if not graph["svg"] and not graph["image_filename"] and not graph["pending"]:
         abort(400, description="グラフ画像の生成に失敗しました。")
 
     year_month = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m")
 
-    return render_template("date/graph.html", date=date, year_month=year_month, image_filename=image_filename)
+    return render_template("date/graph.html", date=date, year_month=year_month, **graph)
+
+@app.route("/date/<date>/timeline.json")
+@conditional(_date_fingerprint, page_cache)
+def show_timeline_json(date):
+    """日別タイムラインのラン一覧（クライアント側で描画する場合用）"""
+    day = get_day_data(date)
+    if day is None:
+        abort(404)
+    return jsonify(date=date, runs=runs_to_json(day_timeline(day)))
 
 @app.route("/date/<date>/summary")
+@conditional(_date_fingerprint, page_cache)
 def show_day_summary(date):
-    filepath = os.path.join(DATA_DIR, f"{date}.csv")
-    if not os.path.exists(filepath):
+    day = get_day_data(date)
+    if day is None:
         abort(404)
 
-    states = ["加工中", "手動加工中", "加工完了", "アラーム", "不明"]
-    durations = {state: 0 for state in states}
-
-    with open(filepath, newline='', encoding='utf-8') as f:
-        for row in csv.reader(f):
-            if len(row) < 5:
-                continue
-            try:
-                r, y, g, c = float(row[1]), float(row[2]), float(row[3]), float(row[4])
-                _, _, state, _ = get_light_status(r, y, g, c)
-                durations[state] += 60  # assuming 1 minute resolution
-            except:
-                continue
+    durations = day.state_seconds()  # assuming 1 minute resolution
 
     for key in durations:
         durations[key] = round(durations[key] / 3600, 2)
@@ -977,6 +1180,7 @@ def show_day_summary(date):
     return render_template("date/summary.html", date=date, year_month=year_month, durations=durations)
 
 @app.route("/date/<date>/hinmoku")
+@conditional(_date_fingerprint, page_cache)
 def show_hinmoku_for_date(date):
     """
     指定日付の品目一覧（行頭に 1..N の行番号列を追加＆リンク化）
@@ -1018,28 +1222,28 @@ def show_hinmoku_for_date(date):
     )
 
 @app.route("/date/<date>/hinmoku/<int:hinmokuno>")
+@conditional(_date_fingerprint, page_cache)
 def show_hinmoku_graph(date, hinmokuno):
     try:
         datetime.strptime(date, "%Y-%m-%d")
     except ValueError:
         abort(404)
 
-    headers, records, filename = read_hinmoku_csv(date)
-    if not headers or not records:
+    hinmoku = read_hinmoku(date)
+    if hinmoku is None or not hinmoku.records:
         abort(404, description="品目リストがありません。")
+    headers, records = hinmoku.headers, hinmoku.records
 
     if hinmokuno < 1 or hinmokuno > len(records):
         abort(404, description="指定の品目番号が範囲外です。")
 
     row = records[hinmokuno - 1]
-    intervals = extract_intervals_from_row(date, row)
+    intervals = hinmoku_intervals(date, hinmoku)[hinmokuno - 1]
     if not intervals:
         abort(400, description="有効な開始/停止区間がありません。")
 
-    image_filename = f"{date}_hinmoku_{hinmokuno}.png"
-    image_path = os.path.join("static", image_filename)
-    ok = generate_graph_image_for_intervals(date, intervals, image_path)
-    if not ok:
+    graph = intervals_graph(get_day_data(date), intervals)
+    if not graph["svg"] and not graph["image_filename"] and not graph["pending"]:
         abort(400, description="グラフ画像の生成に失敗しました。対象区間にデータが無い可能性があります。")
 
     year_month = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m")
@@ -1048,31 +1252,34 @@ def show_hinmoku_graph(date, hinmokuno):
         date=date,
         year_month=year_month,
         hinmokuno=hinmokuno,
-        image_filename=image_filename,
         row=row,
-        headers=headers
+        headers=headers,
+        **graph
     )
 
 @app.route("/date/<date>/hinmoku/<int:hinmokuno>/summary")
+@conditional(_date_fingerprint, page_cache)
 def show_hinmoku_summary(date, hinmokuno):
     try:
         datetime.strptime(date, "%Y-%m-%d")
     except ValueError:
         abort(404)
 
-    headers, records, filename = read_hinmoku_csv(date)
-    if not headers or not records:
+    hinmoku = read_hinmoku(date)
+    if hinmoku is None or not hinmoku.records:
         abort(404, description="品目リストがありません。")
+    headers, records = hinmoku.headers, hinmoku.records
+    filename = os.path.basename(hinmoku.path)
 
     if hinmokuno < 1 or hinmokuno > len(records):
         abort(404, description="指定の品目番号が範囲外です。")
 
     row = records[hinmokuno - 1]
-    intervals = extract_intervals_from_row(date, row)
+    intervals = hinmoku_intervals(date, hinmoku)[hinmokuno - 1]
     if not intervals:
         abort(404, description="有効な開始/停止区間がありません。")
 
-    secs = summarize_states_for_intervals(date, intervals)
+    secs = summarize_states_for_intervals(get_day_data(date), intervals)
     if secs is None:
         abort(404, description=f"{date}.csv が見つかりません。")
 
@@ -1097,25 +1304,28 @@ def show_hinmoku_summary(date, hinmokuno):
     )
 
 @app.route("/date/<date>/hinmoku/<int:hinmokuno>/info")
+@conditional(_date_fingerprint, page_cache)
 def show_hinmoku_info(date, hinmokuno):
     try:
         datetime.strptime(date, "%Y-%m-%d")
     except ValueError:
         abort(404)
 
-    headers, records, filename = read_hinmoku_csv(date)
-    if not headers or not records:
+    hinmoku = read_hinmoku(date)
+    if hinmoku is None or not hinmoku.records:
         abort(404, description="品目リストがありません。")
+    headers, records = hinmoku.headers, hinmoku.records
+    filename = os.path.basename(hinmoku.path)
 
     if hinmokuno < 1 or hinmokuno > len(records):
         abort(404, description="指定の品目番号が範囲外です。")
 
     row = records[hinmokuno - 1]
-    intervals = extract_intervals_from_row(date, row)
+    intervals = hinmoku_intervals(date, hinmoku)[hinmokuno - 1]
     if not intervals:
         abort(404, description="有効な開始/停止区間がありません。")
 
-    secs = summarize_states_for_intervals(date, intervals)
+    secs = summarize_states_for_intervals(get_day_data(date), intervals)
     if secs is None:
         abort(404, description=f"{date}.csv が見つかりません。")
 
@@ -1139,5 +1349,27 @@ def show_hinmoku_info(date, hinmokuno):
         filename=filename
     )
 
+@app.route("/stats/cache")
+def show_cache_stats():
+    return jsonify(day=day_cache.stats(), graph=graph_cache.stats(), page=page_cache.stats(),
+                   hinmoku=hinmoku_cache.stats())
+
+@app.route("/machines")
+def show_machines():
+    """全機械の最新状態の一覧"""
+    machines = [
+        {"name": m, "prefix": machine_ctx(m).url_prefix, "status": get_live_status(m)}
+        for m in list_machines(DATA_DIR)
+    ]
+    return render_template("machines.html", machines=machines)
+
+# 既定の機械以外は同じページを /m/<機械>/... で出す
+for _rule in list(app.url_map.iter_rules()):
+    if _rule.endpoint in ("static", "show_machines"):
+        continue
+    app.add_url_rule(f"/m/<machine>{_rule.rule}",
+                     endpoint=_rule.endpoint, view_func=app.view_functions[_rule.endpoint],
+                     methods=sorted(_rule.methods - {"HEAD", "OPTIONS"}))
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,287 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from day_store import INVALID_SEC, load_day_columns
+from state_classifier import (
+    STATES, STATE_LUT, UNKNOWN, light_codes, seconds_from_counts, state_seconds,
+)
+from state_timeline import StateTimeline
+
+
+class DayData:
+    """
+    1日分のセンサーデータ（パース済み）。
+    リクエスト内で1回だけ読み込み、日全体/区間の集計や分ごとの色をここから切り出す。
+    """
+
+    def __init__(self, date_str, csv_path, columns, mtime=None, size=None, mtime_ns=None):
+        self.date_str = date_str
+        self.csv_path = csv_path
+        self.mtime = mtime
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.day_start = datetime.strptime(date_str, "%Y-%m-%d")
+        self.day_end = self.day_start + timedelta(days=1)
+
+        self.sec = columns.sec
+        self.red = columns.red
+        self.yellow = columns.yellow
+        self.green = columns.green
+        self.current = columns.current
+
+        self._light_codes = None
+        self._codes = None
+        self._state_index = None
+        self._timeline = None
+
+    def __len__(self):
+        return len(self.sec)
+
+    @property
+    def nbytes(self):
+        """キャッシュ容量の見積もり用（列＋判定済みコード＋累積件数表＋タイムライン）"""
+        arrays = [self.sec, self.red, self.yellow, self.green, self.current,
+                  self._light_codes, self._codes]
+        if self._state_index is not None:
+            arrays.extend(self._state_index)
+        total = sum(a.nbytes for a in arrays if a is not None)
+        if self._timeline is not None:
+            total += self._timeline.nbytes
+        return total
+
+    @property
+    def light_codes(self):
+        """4bitコード（赤<<3 | 黄<<2 | 緑<<1 | 機械動作）"""
+        if self._light_codes is None:
+            self._light_codes = light_codes(self.red, self.yellow, self.green, self.current)
+        return self._light_codes
+
+    @property
+    def codes(self):
+        """状態コード（STATES のインデックス）"""
+        if self._codes is None:
+            self._codes = STATE_LUT[self.light_codes]
+        return self._codes
+
+    @property
+    def state_index(self):
+        """
+        区間集計用の累積件数表 (sorted_sec, cum)。
+        sorted_sec は時刻が読める行の経過秒（昇順）、
+        cum[i, code] は sorted_sec の先頭 i 行に含まれる状態 code の行数。
+        """
+        if self._state_index is None:
+            valid = self.sec != INVALID_SEC
+            order = np.argsort(self.sec[valid], kind="stable")
+            sorted_sec = np.asarray(self.sec[valid][order])
+            one_hot = np.eye(len(STATES), dtype=np.int32)[self.codes[valid][order]]
+            cum = np.zeros((len(sorted_sec) + 1, len(STATES)), dtype=np.int32)
+            np.cumsum(one_hot, axis=0, out=cum[1:])
+            self._state_index = (sorted_sec, cum)
+        return self._state_index
+
+    def _clip_seconds(self, start_dt, end_dt):
+        """区間を当日内にクリップし、0:00 からの経過秒 (s, e) にする。"""
+        s = max(start_dt, self.day_start) if start_dt else self.day_start
+        e = min(end_dt, self.day_end) if end_dt else self.day_end
+        return (s - self.day_start).total_seconds(), (e - self.day_start).total_seconds()
+
+    def interval_mask(self, start_dt=None, end_dt=None):
+        """
+        [start_dt, end_dt) に入る行の真偽配列。区間は当日内にクリップする。
+        時刻が読めない行は常に除外。
+        """
+        s_sec, e_sec = self._clip_seconds(start_dt, end_dt)
+        return (self.sec >= s_sec) & (self.sec < e_sec) & (self.sec != INVALID_SEC)
+
+    def state_counts(self, start_dt, end_dt):
+        """[start_dt, end_dt) の状態別行数（STATES 順）。累積件数表の2点参照で求める。"""
+        s_sec, e_sec = self._clip_seconds(start_dt, end_dt)
+        sorted_sec, cum = self.state_index
+        if not (s_sec < e_sec):
+            return cum[0]
+        lo, hi = np.searchsorted(sorted_sec, [s_sec, e_sec], side="left")
+        return cum[hi] - cum[lo]
+
+    def state_seconds(self, start_dt=None, end_dt=None):
+        """
+        状態別合計秒数 {state: 秒}。
+        区間指定なしなら日全体（時刻が読めない行も含む）。
+        """
+        if start_dt is None and end_dt is None:
+            return state_seconds(self.codes)
+        return seconds_from_counts(self.state_counts(start_dt, end_dt))
+
+    @property
+    def timeline(self):
+        """
+        日全体の状態タイムライン（StateTimeline）。
+        グラフは分ちょうどの行だけを使う（同じ分が複数あれば後の行）。
+        """
+        if self._timeline is None:
+            on_minute = (self.sec != INVALID_SEC) & (self.sec % 60 == 0)
+            self._timeline = StateTimeline.from_minutes(self.sec[on_minute] // 60, self.codes[on_minute])
+        return self._timeline
+
+    def minute_range(self, start_dt=None, end_dt=None):
+        """[start_dt, end_dt) に含まれる分を 0:00 からの分番号の範囲 (lo, hi) で返す。"""
+        s_sec, e_sec = self._clip_seconds(start_dt, end_dt)
+        return math.ceil(s_sec / 60), math.ceil(e_sec / 60)
+
+    def timeline_between(self, start_dt=None, end_dt=None, include_gray=True):
+        """[start_dt, end_dt) に切り出したタイムライン。include_gray=False なら不明を除く。"""
+        timeline = self.timeline
+        if start_dt is not None or end_dt is not None:
+            timeline = timeline.slice(*self.minute_range(start_dt, end_dt))
+        return timeline if include_gray else timeline.exclude(UNKNOWN)
+
+    def timeline_for_intervals(self, intervals):
+        """複数区間 [(start_dt, end_dt), ...] を合成したタイムライン（重なりは1回だけ）。"""
+        return self.timeline.select([self.minute_range(s, e) for s, e in intervals])
+
+def _load(csv_path, date_str, st):
+    columns = load_day_columns(csv_path, date_str)
+    if columns is None:
+        return None
+    return DayData(date_str, csv_path, columns,
+                   mtime=st.st_mtime, size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+
+def load_day_data(data_dir, date_str):
+    """data_dir/<date_str>.csv を読み込んだ DayData を返す（CSV が無ければ None）。"""
+    csv_path = os.path.join(data_dir, f"{date_str}.csv")
+    try:
+        st = os.stat(csv_path)
+    except FileNotFoundError:
+        return None
+    return _load(csv_path, date_str, st)
+
+
+class DayCache:
+    """
+    パース・判定済み DayData のプロセス内 LRU キャッシュ。
+    キーは (CSVパス, mtime, サイズ)。書き込み中の当日CSVは変わるたびに読み直し、
+    確定済みの過去日はメモリに載っている限り再パースしない。
+    max_bytes に加えて max_days（日数）でも押し出す（大きい日は mmap で記述子を1つ持つため）。
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_days=256):
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # csv_path -> (fingerprint, DayData, nbytes)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, data_dir, date_str):
+        """load_day_data と同じ。キャッシュが最新ならそれを返す。"""
+        csv_path = os.path.join(data_dir, f"{date_str}.csv")
+        try:
+            st = os.stat(csv_path)
+        except FileNotFoundError:
+            with self._lock:
+                self._discard(csv_path)
+            return None
+        fingerprint = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            entry = self._entries.get(csv_path)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(csv_path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # 読み込みはロック外で（同時ミスは二重に読むだけで結果は同じ）
+        day = _load(csv_path, date_str, st)
+        if day is None:
+            return None
+        day.state_index  # 判定・累積件数表・タイムラインまで済ませてから載せる
+        day.timeline
+        nbytes = day.nbytes
+
+        with self._lock:
+            self._discard(csv_path)
+            if nbytes <= self.max_bytes:
+                self._entries[csv_path] = (fingerprint, day, nbytes)
+                self._bytes += nbytes
+                while self._bytes > self.max_bytes or len(self._entries) > self.max_days:
+                    _, (_, _, size) = self._entries.popitem(last=False)
+                    self._bytes -= size
+                    self.evictions += 1
+        return day
+
+    def _discard(self, csv_path):
+        entry = self._entries.pop(csv_path, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_days": self.max_days,
+            }
+
+
+# ---- ファイル記述子の確認（python day_data.py）----
+
+def _fd_limit_check(days=300, fd_limit=128):
+    """
+    ファイル記述子の上限より多い日を DayCache に読み込んでも EMFILE にならないことを確かめる。
+    mmap する大きいサイドカーと、メモリに読む小さいサイドカーの両方で行う。
+    """
+    import resource
+    import shutil
+    import tempfile
+
+    import day_store
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    mmap_min_bytes = day_store.MMAP_MIN_BYTES
+    tmp = tempfile.mkdtemp(prefix="day_data_check_")
+    try:
+        first = datetime(2020, 1, 1)
+        dates = [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+        for date_str in dates:
+            with open(os.path.join(tmp, f"{date_str}.csv"), "w", newline="", encoding="utf-8") as f:
+                f.writelines(f"{m // 60:02d}:{m % 60:02d}:00,{m % 3 * 100},0,100,{m % 2 * 1.5}\r\n"
+                             for m in range(0, 1440, 5))
+
+        resource.setrlimit(resource.RLIMIT_NOFILE, (fd_limit, hard))
+        for label, min_bytes in (("mmap", 0), ("メモリ読み", mmap_min_bytes)):
+            day_store.MMAP_MIN_BYTES = min_bytes
+            cache = DayCache(max_days=fd_limit // 2)
+            # 1周目は CSV からサイドカーを作り、2周目はサイドカーから読む
+            for _ in range(2):
+                for date_str in dates:
+                    day = cache.get(tmp, date_str)
+                    assert day is not None and len(day) == 288, date_str
+            open_fds = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else "?"
+            print(f"{label}: {days} 日 × 2周（記述子の上限 {fd_limit}）OK"
+                  f"  キャッシュ {cache.stats()['entries']} 日, 開いている記述子 {open_fds}")
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        day_store.MMAP_MIN_BYTES = mmap_min_bytes
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    _fd_limit_check()
@@ -0,0 +1,72 @@
+"""
+センサーCSVのある日付の索引。
+
+data/sensor/ を毎回 listdir してファイル名を strptime する代わりに、
+ディレクトリの mtime（ファイルの作成・削除で変わる）が変わったときだけ読み直す。
+ページ表示ごとのコストは stat 1回で、保存年数が増えても変わらない。
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+# mtime の分解能より短い間隔で作られたファイルを取りこぼさないよう、
+# ディレクトリが直前に変わったばかりなら次回も読み直す
+_SETTLE_NS = 2 * 10**9
+
+
+class DayIndex:
+    """data_dir 内の YYYY-MM-DD.csv の日付一覧（昇順）を保持する。"""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._lock = threading.Lock()
+        self._dir_mtime_ns = None
+        self._dates = []        # "YYYY-MM-DD" 昇順
+        self._date_set = frozenset()
+        self.version = 0        # 日付一覧が変わるたびに増える（派生データのキャッシュキー用）
+
+    def _refresh(self):
+        try:
+            mtime_ns = os.stat(self.data_dir).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        with self._lock:
+            if mtime_ns is not None and mtime_ns == self._dir_mtime_ns:
+                return
+            dates = []
+            if mtime_ns is not None:
+                for fname in os.listdir(self.data_dir):
+                    if not fname.endswith(".csv"):
+                        continue
+                    try:
+                        datetime.strptime(fname[:-4], "%Y-%m-%d")
+                    except ValueError:
+                        continue
+                    dates.append(fname[:-4])
+            dates.sort()
+            if dates != self._dates or not self.version:
+                self._dates = dates
+                self._date_set = frozenset(dates)
+                self.version += 1
+            settled = mtime_ns is not None and time.time_ns() - mtime_ns > _SETTLE_NS
+            self._dir_mtime_ns = mtime_ns if settled else None
+
+    def snapshot(self):
+        """(version, 日付リスト, 日付集合)。同じ version の間は同じ内容。"""
+        self._refresh()
+        with self._lock:
+            return self.version, self._dates, self._date_set
+
+    def has(self, date_str):
+        return date_str in self.snapshot()[2]
+
+    def dates_between(self, start_date, end_date):
+        """[start_date, end_date]（"YYYY-MM-DD"、両端含む）に CSV がある日付の昇順リスト。"""
+        dates = self.snapshot()[1]
+        return dates[bisect_left(dates, start_date):bisect_right(dates, end_date)]
+
+    def dates_in_month(self, year_month):
+        """"YYYY-MM" の月に CSV がある日付の昇順リスト。"""
+        return self.dates_between(f"{year_month}-01", f"{year_month}-31")
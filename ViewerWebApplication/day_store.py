@@ -0,0 +1,185 @@
+"""
+センサーCSV（data/sensor/YYYY-MM-DD.csv）の列指向バイナリ・サイドカー。
+
+CSV の隣の .sidecar/ ディレクトリに YYYY-MM-DD.bin を置き、1ファイルを1回だけ mmap して
+各列をその上のビューとして読む（小さいファイルは mmap せずメモリに読む）
+（CSV と同じディレクトリに書くと、その mtime を見ている DayIndex が書くたびに読み直すため）。
+ヘッダに元CSVの (サイズ, mtime) を記録し、CSV が変わっていれば自動で作り直す。
+
+レイアウト（リトルエンディアン）:
+    ヘッダ 32 byte: magic(8) / csv_size(u8) / csv_mtime_ns(i8) / rows(u4) / 予約(4)
+    sec     uint32 x rows   0:00 からの経過秒（時刻が読めない行は INVALID_SEC）
+    red     uint16 x rows
+    yellow  uint16 x rows
+    green   uint16 x rows
+    current float32 x rows
+"""
+import csv
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from fast_time import sec_of_day
+
+MAGIC = b"FDVDAY1\0"
+HEADER = struct.Struct("<8sQqI4x")
+INVALID_SEC = np.iinfo(np.uint32).max
+SIDECAR_DIR = ".sidecar"
+SIDECAR_EXT = ".bin"
+# これより小さいサイドカーは mmap せずメモリに読む。mmap は1つにつきファイル記述子を1つ
+# 開いたままにするので、DayCache に何百日も載せると記述子が尽きる
+MMAP_MIN_BYTES = 1024 * 1024
+
+COLUMNS = [
+    ("sec", np.dtype("<u4")),
+    ("red", np.dtype("<u2")),
+    ("yellow", np.dtype("<u2")),
+    ("green", np.dtype("<u2")),
+    ("current", np.dtype("<f4")),
+]
+
+DayColumns = namedtuple("DayColumns", [name for name, _ in COLUMNS])
+
+
+def sidecar_path(csv_path):
+    csv_dir, name = os.path.split(csv_path)
+    return os.path.join(csv_dir, SIDECAR_DIR, os.path.splitext(name)[0] + SIDECAR_EXT)
+
+
+def _legacy_sidecar_path(csv_path):
+    # 以前は CSV と同じディレクトリに置いていた
+    return os.path.splitext(csv_path)[0] + SIDECAR_EXT
+
+
+def format_sec(sec):
+    """経過秒を CSV と同じ "HH:MM:SS" に戻す（時刻不正の行は空文字）。"""
+    if sec == INVALID_SEC:
+        return ""
+    sec = int(sec)
+    return f"{sec // 3600:02d}:{sec // 60 % 60:02d}:{sec % 60:02d}"
+
+
+def _csv_rows(csv_path):
+    """センサーCSVの有効な行を (時刻の文字列, (赤, 黄, 緑, 電流)) で返す（列不足・数値変換できない行は除く）。"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 5:
+                continue
+            try:
+                values = (float(row[1]), float(row[2]), float(row[3]), float(row[4]))
+            except ValueError:
+                continue
+            yield row[0], values
+
+
+def read_time_texts(csv_path):
+    """
+    DayColumns と同じ並びの、CSV に書かれたままの時刻の文字列のリスト（表示用）。
+    サイドカーには経過秒しか無く、読めない時刻（BOM 付きなど）は元の文字列に戻せないため。
+    """
+    return [time_text for time_text, _ in _csv_rows(csv_path)]
+
+
+def parse_csv_columns(csv_path, date_str):
+    """
+    センサーCSVをパースして DayColumns（numpy配列）を返す。
+    列不足・数値変換できない行は除外。時刻が読めない行は sec=INVALID_SEC で残す
+    （日全体の集計には含め、区間・グラフからは外すため）。
+    """
+    secs, values = [], []
+    for time_text, row_values in _csv_rows(csv_path):
+        values.append(row_values)
+        sec = sec_of_day(time_text)
+        secs.append(INVALID_SEC if sec is None else sec)
+
+    arr = np.array(values, dtype=np.float64).reshape(-1, 4)
+    # 照度は 0..65535 に丸めても閾値判定（>= 整数閾値）は変わらない
+    lux = np.clip(np.nan_to_num(arr[:, :3]), 0, 65535).astype(np.uint16)
+    return DayColumns(
+        sec=np.array(secs, dtype=np.uint32),
+        red=lux[:, 0].copy(),
+        yellow=lux[:, 1].copy(),
+        green=lux[:, 2].copy(),
+        current=arr[:, 3].astype(np.float32),
+    )
+
+
+def write_sidecar(path, columns, csv_size, csv_mtime_ns):
+    """一時ファイルに書いてから置き換える（読み手に書きかけを見せない）。"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, csv_size, csv_mtime_ns, len(columns.sec)))
+            for (name, dtype), values in zip(COLUMNS, columns):
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_sidecar(path, csv_size, csv_mtime_ns):
+    """
+    サイドカーを読んで DayColumns（読み取り専用の配列）を返す。
+    MMAP_MIN_BYTES 以上ならファイル全体を1回だけ mmap し、各列はそのビューにする。
+    存在しない・壊れている・元CSVと一致しない場合は None。
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(HEADER.size)
+            if len(head) < HEADER.size:
+                return None
+            magic, size, mtime_ns, rows = HEADER.unpack(head)
+            if magic != MAGIC or size != csv_size or mtime_ns != csv_mtime_ns:
+                return None
+            expected = HEADER.size + rows * sum(dtype.itemsize for _, dtype in COLUMNS)
+            if os.fstat(f.fileno()).st_size != expected:
+                return None
+            if rows == 0:
+                return DayColumns(*(np.empty(0, dtype=dtype) for _, dtype in COLUMNS))
+            if expected >= MMAP_MIN_BYTES:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = head + f.read()
+                if len(buf) != expected:
+                    return None
+    except (OSError, ValueError):
+        return None
+
+    arrays = []
+    offset = HEADER.size
+    for _, dtype in COLUMNS:
+        arrays.append(np.frombuffer(buf, dtype=dtype, count=rows, offset=offset))
+        offset += rows * dtype.itemsize
+    return DayColumns(*arrays)
+
+
+def load_day_columns(csv_path, date_str):
+    """
+    1日分のセンサーデータを DayColumns で返す（CSV が無ければ None）。
+    サイドカーが最新ならそれを読み（read_sidecar）、古ければ CSV をパースして作り直す。
+    """
+    try:
+        st = os.stat(csv_path)
+    except FileNotFoundError:
+        return None
+
+    path = sidecar_path(csv_path)
+    columns = read_sidecar(path, st.st_size, st.st_mtime_ns)
+    if columns is not None:
+        return columns
+
+    columns = parse_csv_columns(csv_path, date_str)
+    try:
+        write_sidecar(path, columns, st.st_size, st.st_mtime_ns)
+        legacy = _legacy_sidecar_path(csv_path)
+        if os.path.exists(legacy):
+            os.remove(legacy)
+    except OSError as e:
+        # 書けなくても読み出しは続行（次回また CSV をパース）
+        print(f"サイドカー書き込みエラー: {e}")
+    return columns
@@ -0,0 +1,178 @@
+"""
+センサーCSVの時刻列と品目CSVの日時の高速パーサ。
+
+datetime.strptime は書式の正規表現を毎回たどるので、1行ごとに呼ぶと重い。
+よくある形（"HH:MM:SS"、"YYYY/M/D H:M[:S]"）は文字列を切って int にするだけで読み、
+それ以外の形は従来どおり strptime で読む（結果は従来の処理と同じ）。
+
+python fast_time.py で、乱数で作った文字列に対して従来の処理と結果を突き合わせ（性質テスト）、
+1行あたりの速度を比べる。
+"""
+from datetime import datetime
+
+# 従来の sensor 時刻の読み方：date_str + " " + 時刻 を "%Y-%m-%d %H:%M:%S" で読んでいた。
+# 日付部分は結果に関係しないので固定の日付を前に付ける
+_SENSOR_FORMAT = "%Y-%m-%d %H:%M:%S"
+_SENSOR_PREFIX = "2000-01-01 "
+
+
+def _sec_of_day_strptime(s):
+    t = datetime.strptime(_SENSOR_PREFIX + s, _SENSOR_FORMAT)
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def sec_of_day(s):
+    """センサーCSVの時刻 "HH:MM:SS" → 0:00 からの秒。読めなければ None。"""
+    if len(s) == 8 and s[2] == ":" and s[5] == ":":
+        hh, mm, ss = s[0:2], s[3:5], s[6:8]
+        digits = hh + mm + ss
+        if digits.isascii() and digits.isdigit():
+            h, m, sec = int(hh), int(mm), int(ss)
+            if h < 24 and m < 60 and sec < 60:
+                return h * 3600 + m * 60 + sec
+    try:
+        return _sec_of_day_strptime(s)
+    except ValueError:
+        return None
+
+
+def minute_of_day(s):
+    """センサーCSVの時刻 → 0:00 からの分（秒は切り捨て）。読めなければ None。"""
+    sec = sec_of_day(s)
+    return None if sec is None else sec // 60
+
+
+def _parse_flexible_dt_strptime(s):
+    """従来の parse_flexible_dt（書式を順に strptime し、だめなら区切りを揃えて読み直す）"""
+    s = s.strip()
+    fmts = [
+        "%Y/%m/%d %H:%M:%S",
+        "%Y/%m/%d %H:%M",
+        "%Y/%-m/%-d %-H:%-M:%-S",  # Linux系のゼロ無し。Windowsでは無視されるが例として残す
+        "%Y/%-m/%-d %-H:%-M",
+    ]
+    for fmt in fmts:
+        try:
+            return datetime.strptime(s, fmt)
+        except Exception:
+            continue
+    # 上の %- 指定は環境依存。最後に標準的な置換で再トライ
+    try:
+        # ゼロ詰めして秒なしをまず試す
+        parts = s.replace("/", " ").replace(":", " ").split()
+        # ["YYYY","M","D","H","M"(,"S")]
+        if len(parts) >= 5:
+            Y, M, D, h, m = parts[:5]
+            sec = parts[5] if len(parts) >= 6 else "00"
+            canon = f"{int(Y):04d}/{int(M):02d}/{int(D):02d} {int(h):02d}:{int(m):02d}:{int(sec):02d}"
+            return datetime.strptime(canon, "%Y/%m/%d %H:%M:%S")
+    except Exception:
+        pass
+    raise ValueError("日時の形式が不正です")
+
+
+def parse_flexible_dt(s):
+    """
+    "YYYY/M/D H:M[:S]" 形式（ゼロ詰め無しOK、秒あり/なし両対応）を受け付けて datetime を返す。
+    例: "2025/8/4 8:46", "2025/08/04 08:46:13"。読めなければ ValueError。
+    """
+    t = s.strip()
+    date_part, sep, time_part = t.partition(" ")
+    if sep:
+        d = date_part.split("/")
+        hm = time_part.split(":")
+        if len(d) == 3 and 2 <= len(hm) <= 3 and len(d[0]) == 4:
+            fields = d + hm
+            digits = "".join(fields)
+            if all(0 < len(x) <= 2 for x in fields[1:]) and digits.isascii() and digits.isdigit():
+                try:
+                    return datetime(int(d[0]), int(d[1]), int(d[2]),
+                                    int(hm[0]), int(hm[1]), int(hm[2]) if len(hm) == 3 else 0)
+                except ValueError:
+                    pass
+    return _parse_flexible_dt_strptime(s)
+
+
+# ---- 性質テストと速度比較（python fast_time.py）----
+
+def _outcome(fn, s):
+    try:
+        return fn(s)
+    except ValueError:
+        return ValueError
+
+
+def _random_text(rng, seps):
+    # 数字（桁数ばらばら・範囲外含む）と区切りを混ぜた文字列
+    out = []
+    for _ in range(rng.randint(0, 8)):
+        r = rng.random()
+        if r < 0.6:
+            out.append(str(rng.randint(0, 10 ** rng.randint(1, 4) - 1)).zfill(rng.choice((0, 0, 1, 2, 4))))
+        elif r < 0.9:
+            out.append(rng.choice(seps))
+        else:
+            out.append(rng.choice(("+", "-", "_", "a", "٣", "²", "")))
+    return "".join(out)
+
+
+def _random_sensor_time(rng):
+    if rng.random() < 0.5:
+        return f"{rng.randint(0, 25):02d}:{rng.randint(0, 61):02d}:{rng.randint(0, 61):02d}"
+    return _random_text(rng, (":", ":", ":", " ", "\t"))
+
+
+def _random_hinmoku_dt(rng):
+    if rng.random() < 0.5:
+        fields = [rng.randint(1990, 2040), rng.randint(0, 13), rng.randint(0, 32),
+                  rng.randint(0, 24), rng.randint(0, 60), rng.randint(0, 61)]
+        pad = [f"{v:02d}" if rng.random() < 0.5 else str(v) for v in fields]
+        s = f"{pad[0]}/{pad[1]}/{pad[2]} {pad[3]}:{pad[4]}" + (f":{pad[5]}" if rng.random() < 0.5 else "")
+        return rng.choice(("", " ", "\t")) + s + rng.choice(("", " ", "\r\n"))
+    return _random_text(rng, ("/", "/", ":", ":", " ", " ", "  ", "\t"))
+
+
+def _property_check(rounds=50000, seed=0):
+    import random
+
+    rng = random.Random(seed)
+    fixed_sensor = ["00:00:00", "23:59:59", "24:00:00", "12:60:00", "12:00:60", "12:00:61",
+                    "8:5:3", " 08:00:00", "08:00:00 ", "٠٨:00:00", "+8:00:00", "", "08:00"]
+    fixed_hinmoku = ["2025/8/4 8:46", "2025/08/04 08:46:13", "2025/2/29 0:00", "2024/2/29 0:00",
+                     "2025/8/4 8:46:13 junk", "2025 8 4 8 46", "2025/8/4  8:46", "2025/08/04 24:00",
+                     "0000/1/1 0:0", "2025/8/ 4 8:46", "2025/+8/4 8:46", "2025/8/4 8:46:60", ""]
+    for s in fixed_sensor + [_random_sensor_time(rng) for _ in range(rounds)]:
+        got, want = sec_of_day(s), _outcome(_sec_of_day_strptime, s)
+        assert got == (None if want is ValueError else want), (s, got, want)
+    for s in fixed_hinmoku + [_random_hinmoku_dt(rng) for _ in range(rounds)]:
+        got, want = _outcome(parse_flexible_dt, s), _outcome(_parse_flexible_dt_strptime, s)
+        assert got == want, (s, got, want)
+    print(f"性質テスト: センサー時刻・品目日時 各 {rounds} 件 + 固定例 OK")
+
+
+def _benchmark(rows=100000):
+    import time
+
+    sensor = [f"{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}" for i in range(rows)]
+    hinmoku = [f"2025/{i % 12 + 1}/{i % 28 + 1} {i % 24}:{i % 60:02d}" for i in range(rows)]
+    cases = [
+        ("センサー時刻", sensor,
+         lambda s: datetime.strptime("2025-09-09 " + s, _SENSOR_FORMAT), sec_of_day),
+        ("品目日時", hinmoku, _parse_flexible_dt_strptime, parse_flexible_dt),
+    ]
+    for label, data, old, new in cases:
+        t = time.perf_counter()
+        for s in data:
+            old(s)
+        old_sec = time.perf_counter() - t
+        t = time.perf_counter()
+        for s in data:
+            new(s)
+        new_sec = time.perf_counter() - t
+        print(f"{label}: 従来 {old_sec / rows * 1e6:.2f}µs/行  高速 {new_sec / rows * 1e6:.2f}µs/行"
+              f"（{old_sec / new_sec:.1f}倍）")
+
+
+if __name__ == "__main__":
+    _property_check()
+    _benchmark()
@@ -0,0 +1,220 @@
+"""
+LoRa 受信フレームの切り出しと解読（lora_logger 用）。
+
+フレーム = ヘッダ3バイト + 種別1バイト + 本体 + CRLF。
+  ヘッダは宛先アドレス上位・下位とチャンネル（送信側ファームの固定値で、送信元は入っていない）
+  D（照度）: 本体は赤・黄・緑の uint16 ビッグエンディアン（固定12バイト）
+  C（電流）: 本体は ASCII の数値（最初の CRLF まで）
+受信バッファ（bytearray）を使い回し、struct.unpack_from でバッファ上の位置から
+直接読むので、フレームごとの bytes のコピーや1バイトずつのループは無い。
+フレームに誤り検出用の値は無いため、長さ・終端（CRLF）・本体の形式で検査する。
+
+python frame_codec.py でファズ（コーパス＋乱数）と速度比較を実行する。
+"""
+import logging
+import struct
+from collections import namedtuple
+
+log = logging.getLogger("lora_logger")
+
+LightFrame = namedtuple("LightFrame", "header red yellow green")  # header はヘッダ3バイト（24bit 整数）
+CurrentFrame = namedtuple("CurrentFrame", "header current")
+
+_HEAD = struct.Struct(">I")         # ヘッダ3バイト + 種別1バイト
+_D_FRAME = struct.Struct(">I3H")    # ヘッダ + 種別, 赤, 黄, 緑
+_C = ord("C")
+_D = ord("D")
+
+D_FRAME_LEN = 12
+MAX_FRAME_LEN = 64
+MAX_CURRENT_LEN = 16  # C の本体（数値の文字列）の最大長
+
+
+def _decode(buf, pos, end):
+    """buf[pos:end + 2] の1フレーム（end は CR の位置）を解読する。不正なら None。"""
+    head = _HEAD.unpack_from(buf, pos)[0]
+    mode = head & 0xFF
+    if mode == _D:
+        if end - pos != D_FRAME_LEN - 2:
+            return None
+        _, red, yellow, green = _D_FRAME.unpack_from(buf, pos)
+        return LightFrame(head >> 8, red, yellow, green)
+    if mode == _C:
+        if not 0 < end - pos - 4 <= MAX_CURRENT_LEN:
+            return None
+        try:
+            current = float(buf[pos + 4:end])
+        except ValueError:
+            return None
+        return CurrentFrame(head >> 8, current)
+    return None
+
+
+def decode_frame(frame):
+    """CRLF までを含む1フレーム（bytes 等）を LightFrame / CurrentFrame にする。不正なら None。"""
+    if len(frame) < 6 or frame[-2:] != b"\r\n":
+        return None
+    return _decode(frame, 0, len(frame) - 2)
+
+
+class FrameParser:
+    """
+    受信バイト列をフレームに切り出して解読する。
+    D は長さで切る（照度の値に 0x0D0A が含まれても切れない）。C は最初の CRLF まで。
+    途中までしか届いていないフレームは次の feed() まで持ち越す。
+    不正なフレームやごみは次の CRLF まで読み捨てて同期し直す（届き方によらず結果は同じ）。
+    読み終えた分の詰め直しは feed() 1回につき1度だけ。
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._skipping = False  # 次の CRLF まで読み捨て中
+        self.dropped = 0        # 捨てたフレーム（区切り単位）の数
+
+    def feed(self, data):
+        """data を追加し、解読できたフレーム（LightFrame / CurrentFrame）のリストを返す。"""
+        buf = self._buf
+        buf += data
+        n = len(buf)
+        pos = 0
+        records = []
+        if self._skipping:
+            end = buf.find(b"\r\n")
+            if end < 0:
+                del buf[:-1]  # 末尾の \r は残す
+                return records
+            self._skipping = False
+            pos = end + 2
+        while n - pos >= 4:
+            mode = buf[pos + 3]
+            if mode == _D:
+                if n - pos < D_FRAME_LEN:
+                    break
+                if buf[pos + 10] == 0x0D and buf[pos + 11] == 0x0A:
+                    head, red, yellow, green = _D_FRAME.unpack_from(buf, pos)
+                    records.append(LightFrame(head >> 8, red, yellow, green))
+                    pos += D_FRAME_LEN
+                    continue
+
+            # C の本体、または読み捨てる範囲の終わり（種別不明なら先頭から区切りを探して同期し直す）
+            known = mode == _C or mode == _D
+            end = buf.find(b"\r\n", pos + 4 if known else pos)
+            if end < 0:
+                if not known or n - pos > MAX_FRAME_LEN:
+                    # 区切りが来るまで読み捨てる
+                    self.dropped += 1
+                    self._skipping = True
+                    pos = n - 1
+                break
+            record = _decode(buf, pos, end) if mode == _C and end + 2 - pos <= MAX_FRAME_LEN else None
+            if record is not None:
+                records.append(record)
+            else:
+                self.dropped += 1
+                log.debug(f"不正なフレームを破棄: {bytes(buf[pos:end + 2])!r}")
+            pos = end + 2
+        if pos:
+            del buf[:pos]
+        return records
+
+
+# ---- ファズと速度比較（python frame_codec.py）----
+
+# 境界になりやすい入力。(受信バイト列, 期待する解読結果)
+CORPUS = [
+    (b"\x01\x02\x03D\x00\x10\x00\x20\x00\x30\r\n", [LightFrame(0x010203, 16, 32, 48)]),
+    (b"\x01\x02\x03D\x0d\x0a\x0d\x0a\x0d\x0a\r\n", [LightFrame(0x010203, 0x0D0A, 0x0D0A, 0x0D0A)]),
+    (b"\x01\x02\x03C12.5\r\n", [CurrentFrame(0x010203, 12.5)]),
+    (b"\x01\x02\x03C-0.25\r\n\x01\x02\x03C3\r\n", [CurrentFrame(0x010203, -0.25), CurrentFrame(0x010203, 3.0)]),
+    (b"\x01\x02\x03C\r\n", []),                       # 本体なし
+    (b"\x01\x02\x03Cabc\r\n", []),                    # 数値でない
+    (b"\x01\x02\x03C" + b"9" * 40 + b"\r\n", []),     # 本体が長すぎる
+    (b"\x01\x02\x03X12\r\n\x01\x02\x03C1\r\n", [CurrentFrame(0x010203, 1.0)]),  # 種別不明の後
+    (b"junk\r\n\x01\x02\x03D\x00\x01\x00\x02\x00\x03\r\n", [LightFrame(0x010203, 1, 2, 3)]),
+    (b"\x01\x02\x03D\x00\x01\x00\x02\r\n", []),       # 短い D（続きが来るまで待つ）
+    (b"\x01\x02\x03D\x00\x01\x00\x02\x00\x03\x00\r\n\x01\x02\x03C2\r\n", [CurrentFrame(0x010203, 2.0)]),  # 長い D
+    (b"\xff" * 100 + b"\x01\x02\x03C7\r\n", []),     # 区切りのないごみ（先頭の同期が外れたまま）
+]
+
+
+def _legacy_decode(data):
+    """以前の data_receive_action と同じ手順の解読（速度比較用）"""
+    mode = chr(data[3])
+    if mode == "C":
+        for i in range(4, len(data) - 1):
+            if data[i] == 0x0D and data[i + 1] == 0x0A:
+                return float(bytes(data[4:i]).decode("ascii"))
+    elif mode == "D" and len(data) >= 10:
+        return ((data[4] << 8) | data[5], (data[6] << 8) | data[7], (data[8] << 8) | data[9])
+    return None
+
+
+def _fuzz(rounds=2000, seed=0):
+    import random
+
+    rng = random.Random(seed)
+    for data, expected in CORPUS:
+        got = FrameParser().feed(data)
+        assert got == expected, (data, got, expected)
+
+    pieces = [data for data, _ in CORPUS] + [bytes([b]) for b in b"\r\nCD\x00\xff"]
+    for _ in range(rounds):
+        stream = b"".join(
+            rng.choice(pieces) if rng.random() < 0.7 else rng.randbytes(rng.randint(1, 20))
+            for _ in range(rng.randint(1, 30))
+        )
+        whole = FrameParser().feed(stream)
+        parser, chunked, pos = FrameParser(), [], 0
+        while pos < len(stream):
+            step = rng.randint(1, 16)
+            chunked += parser.feed(memoryview(stream)[pos:pos + step])
+            pos += step
+        assert whole == chunked, stream
+    print(f"fuzz: コーパス {len(CORPUS)} 件 + 乱数 {rounds} 回 OK")
+
+
+def _legacy_feed(buf, data):
+    """以前の FrameParser と同じ手順（フレームごとに bytes を作って先頭を詰める）の切り出し"""
+    buf += data
+    frames = []
+    while len(buf) >= 4:
+        end = buf.find(b"\r\n", D_FRAME_LEN - 2 if buf[3] == _D else 4)
+        if end < 0:
+            break
+        frames.append(bytes(buf[:end + 2]))
+        del buf[:end + 2]
+    return frames
+
+
+def _benchmark(frames=200000):
+    import time
+
+    one = b"\x01\x02\x03D\x01\x00\x02\x00\x03\x00\r\n\x01\x02\x03C12.34\r\n"
+    stream = one * (frames // 2)
+    chunks = [stream[i:i + 256] for i in range(0, len(stream), 256)]
+
+    t = time.perf_counter()
+    buf = bytearray()
+    count = 0
+    for chunk in chunks:
+        for frame in _legacy_feed(buf, chunk):
+            _legacy_decode(frame)
+            count += 1
+    legacy_sec = time.perf_counter() - t
+    assert count == frames
+
+    t = time.perf_counter()
+    parser = FrameParser()
+    count = 0
+    for chunk in chunks:
+        count += len(parser.feed(chunk))
+    new_sec = time.perf_counter() - t
+    assert count == frames
+
+    print(f"以前の方式: {legacy_sec:.3f}s  frame_codec: {new_sec:.3f}s"
+          f"（{frames} フレーム, {frames / new_sec:,.0f} フレーム/秒, {legacy_sec / new_sec:.1f}倍）")
+
+
+if __name__ == "__main__":
+    _fuzz()
+    _benchmark()
@@ -0,0 +1,130 @@
+"""
+日別グラフ・品目区間グラフ PNG の内容キャッシュ。
+
+ファイル名を（センサーCSVの (パス, サイズ, mtime), 区間の組, 描画設定）のハッシュにするので、
+CSV が変われば別の名前になり、同じ区間の組なら行や日をまたいで同じ画像を使い回す。
+品目CSVの行が並べ替わっても、行番号で名前を付けていたときのように別の行の画像は出ない。
+置き場（static/graphs/）は max_bytes を超えたら古く使われたものから消す。
+"""
+import glob
+import hashlib
+import os
+import threading
+
+
+class GraphCache:
+    """
+    directory 内の <キー>.png を管理する。参照されるたびに mtime を更新し、LRU の順序に使う。
+    legacy_patterns は static_dir 直下の以前の出力先（glob）。初回の追加時に消す。
+    """
+
+    def __init__(self, directory, max_bytes, static_dir="static", legacy_patterns=()):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.static_dir = static_dir
+        self.legacy_patterns = legacy_patterns
+        self._lock = threading.Lock()
+        self._bytes = None  # 置き場の合計サイズ（初回の追加時に数える）
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def key(*parts):
+        """描画内容を決める値（repr が安定しているもの）からキーを作る。"""
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:24]
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def filename(self, key):
+        """static/ からの相対パス（テンプレートの image_filename 用）"""
+        return os.path.relpath(self.path(key), self.static_dir).replace(os.sep, "/")
+
+    def get(self, key):
+        """描画済みなら True（LRU 用に mtime を更新する）。"""
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def touch(self, keys):
+        """keys の画像の mtime を更新する（参照しているページをキャッシュから返すとき）。1つでも無ければ False。"""
+        ok = True
+        for key in keys:
+            try:
+                os.utime(self.path(key))
+            except FileNotFoundError:
+                ok = False
+        return ok
+
+    def added(self, path):
+        """path に画像を書き終えたら呼ぶ（置き場の外の path は数えない）。上限を超えていれば古いものから消す。"""
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory):
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._bytes is None:
+                self._remove_legacy()
+                self._bytes = self._scan_bytes()
+            else:
+                self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".png") and entry.is_file():
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _remove_legacy(self):
+        for pattern in self.legacy_patterns:
+            for path in glob.glob(os.path.join(self.static_dir, pattern)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _scan_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # 上限の 9 割まで減らす（追加のたびに走査しないよう余裕を持たせる）
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 9 // 10
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evicted += 1
+        self._bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+            }
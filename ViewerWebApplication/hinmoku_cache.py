@@ -0,0 +1,96 @@
+"""
+品目CSV（data/hinmoku/<機械>_YYYYMMDD.csv）のパース結果のキャッシュ。
+
+キーは (パス, mtime, サイズ)。server_file_copy がファイルを更新したときだけ読み直し、
+それ以外はデコード済みの行・判定した文字コード・各行の開始/停止時刻を使い回す。
+ファイルは1回だけ読み、バイト列を cp932 → utf-8 の順にデコードする。
+"""
+import csv
+import io
+import os
+import threading
+from collections import OrderedDict
+
+ENCODINGS = ("cp932", "utf-8")
+
+
+class HinmokuFile:
+    """1ファイル分のパース結果。row_times[i] は records[i] の parse_row の結果。"""
+
+    def __init__(self, path, headers, records, encoding, row_times):
+        self.path = path
+        self.headers = headers
+        self.records = records
+        self.encoding = encoding
+        self.row_times = row_times
+        self.resolved = None  # 確定した日の区間リスト（app 側で一度だけ作る）
+
+
+def _decode(data):
+    for enc in ENCODINGS:
+        try:
+            return data.decode(enc), enc
+        except UnicodeDecodeError:
+            continue
+    return None, None
+
+
+def load_hinmoku(path, parse_row):
+    """path を読んで HinmokuFile を返す。無い・空・読めなければ None。"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    text, encoding = _decode(data)
+    if text is None:
+        return None
+    rows = [row for row in csv.reader(io.StringIO(text, newline="")) if row]
+    if not rows:
+        return None
+    records = rows[1:]
+    return HinmokuFile(path, rows[0], records, encoding, [parse_row(row) for row in records])
+
+
+class HinmokuCache:
+    """
+    HinmokuFile の LRU キャッシュ（max_files 件まで）。
+    parse_row(row) は1行から開始/停止時刻を取り出す関数（日時の解釈は app 側）。
+    """
+
+    def __init__(self, parse_row, max_files=64):
+        self.parse_row = parse_row
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> (fingerprint, HinmokuFile or None)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return None
+        fingerprint = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        hinmoku = load_hinmoku(path, self.parse_row)
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = (fingerprint, hinmoku)
+            while len(self._entries) > self.max_files:
+                self._entries.popitem(last=False)
+        return hinmoku
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,253 @@
+"""
+データに紐づいた HTTP キャッシュ（ETag / 304 / Cache-Control）。
+
+ETag はページの元になったファイル（センサーCSV・品目CSV）の (サイズ, mtime) から作るので、
+ページを描かなくても「前回から変わっていない」ことが分かり、304 だけを返せる。
+確定した過去の日・月は長め、当日・当月は短めの max-age を付ける。
+ETag にはプロセスの起動時刻も混ぜる（デプロイでテンプレートが変わったら全部作り直し）。
+
+確定した日・月のページは、描いた HTML を ETag をキーに PageCache に残す。
+元CSVが変われば ETag が変わるので、古いページは使われずに LRU で押し出される。
+ページが参照する画像（graph_cache のキー）は page_uses() で記録し、キャッシュから返すたびに
+touch() で LRU を更新する（画像が消されていればそのページは描き直す）。
+304 も同じで、発行した ETag ごとに参照先を覚えておき、画像が残っているときだけ返す。
+グラフ生成中など no_store() を呼んだレスポンスには ETag を付けず、no-store にする
+（「生成中」のページがクライアントに残って、以後 304 で使い回されないように）。
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, make_response, request
+
+_BOOT_ID = f"{os.getpid()}-{time.time_ns()}"
+ISSUED_ETAGS_MAX = 4096  # 304 の判定用に覚えておく ETag の数
+
+_issued_lock = threading.Lock()
+_issued = OrderedDict()  # ETag -> そのページが参照する画像のキー（タプル）
+
+
+def file_fingerprint(path):
+    """(サイズ, mtime_ns)。ファイルが無ければ None。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr((_BOOT_ID,) + parts).encode("utf-8")).hexdigest()[:24]
+
+
+def no_store():
+    """このレスポンスはキャッシュさせない（描画待ちの「生成中」など、元データ以外で中身が変わる場合）。"""
+    g.no_http_cache = True
+
+
+def _remember_etag(etag, deps):
+    with _issued_lock:
+        _issued.pop(etag, None)
+        _issued[etag] = tuple(deps)
+        while len(_issued) > ISSUED_ETAGS_MAX:
+            _issued.popitem(last=False)
+
+
+def _still_valid(etag, touch):
+    """etag を発行したときのページが今もそのまま使えるか（このプロセスで発行し、参照する画像が残っている）。"""
+    with _issued_lock:
+        deps = _issued.get(etag)
+        if deps is None:
+            return False
+        _issued.move_to_end(etag)
+    return not deps or touch is None or touch(deps)
+
+
+def page_uses(*keys):
+    """描いているページが参照する画像のキー（PageCache の touch に渡す）。"""
+    g.setdefault("page_deps", []).extend(keys)
+
+
+class PageCache:
+    """
+    描いたページ（本文, mimetype）のプロセス内 LRU キャッシュ。キーは ETag。
+    spill_dir を指定すると、メモリから押し出したページをそこへ書き、次に要るとき読み戻す
+    （spill_max_bytes を超えたら古いファイルから消す。起動時に前回分は消す）。
+    touch(deps) はヒットのたびにページが参照するもの（page_uses で記録）を渡して呼ばれ、
+    False（参照先が無い）ならそのページは捨ててミス扱いにする。
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, spill_dir=None, spill_max_bytes=256 * 1024 * 1024,
+                 touch=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.touch = touch
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (body, mimetype, 描画秒, 参照先のタプル)
+        self._bytes = 0
+        self._spilled = OrderedDict()  # key -> バイト数（古い順）
+        self._spill_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spill_hits = 0
+        self.saved_sec = 0.0  # ヒットで省けた描画時間の合計
+        self._spill_ready = False  # 前回分の掃除は最初に書き出すときに行う（import しただけでは消さない）
+
+    def _prepare_spill_dir(self):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        for name in os.listdir(self.spill_dir):
+            if name.endswith(".page"):
+                os.remove(os.path.join(self.spill_dir, name))
+        self._spill_ready = True
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.page")
+
+    def get(self, key):
+        """(body, mimetype, 参照先のタプル) か None。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            spilled = entry is None and key in self._spilled
+        from_spill = False
+        if spilled:
+            try:
+                with open(self._spill_path(key), "rb") as f:
+                    render_sec, mimetype, deps, body = f.read().split(b"\n", 3)
+                entry = (body, mimetype.decode("ascii"), float(render_sec),
+                         tuple(deps.decode("ascii").split()))
+            except (OSError, ValueError):
+                entry = None
+            else:
+                from_spill = True
+
+        if entry is not None and entry[3] and self.touch is not None and not self.touch(entry[3]):
+            # 参照している画像が消えている：このページは使わない
+            self._discard(key)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.spill_hits += from_spill
+            self.saved_sec += entry[2]
+        if from_spill:
+            self.put(key, *entry)
+        return entry[0], entry[1], entry[3]
+
+    def _discard(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            size = self._spilled.pop(key, None)
+            if size is not None:
+                self._spill_bytes -= size
+        if size is not None:
+            try:
+                os.remove(self._spill_path(key))
+            except OSError:
+                pass
+
+    def put(self, key, body, mimetype, render_sec, deps=()):
+        if len(body) > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (body, mimetype, render_sec, tuple(deps))
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                old_key, old = self._entries.popitem(last=False)
+                self._bytes -= len(old[0])
+                evicted.append((old_key, old))
+        if self.spill_dir:
+            for old_key, old in evicted:
+                self._spill(old_key, *old)
+
+    def _spill(self, key, body, mimetype, render_sec, deps):
+        try:
+            if not self._spill_ready:
+                self._prepare_spill_dir()
+            with open(self._spill_path(key), "wb") as f:
+                f.write(f"{render_sec}\n{mimetype}\n{' '.join(deps)}\n".encode("ascii") + body)
+        except OSError:
+            return
+        with self._lock:
+            if key not in self._spilled:
+                self._spilled[key] = len(body)
+                self._spill_bytes += len(body)
+            while self._spill_bytes > self.spill_max_bytes:
+                old_key, size = self._spilled.popitem(last=False)
+                self._spill_bytes -= size
+                try:
+                    os.remove(self._spill_path(old_key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "pages": len(self._entries),
+                "bytes": self._bytes,
+                "spilled_pages": len(self._spilled),
+                "spilled_bytes": self._spill_bytes,
+                "hits": self.hits,
+                "spill_hits": self.spill_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else None,
+                "saved_render_sec": round(self.saved_sec, 3),
+            }
+
+
+def conditional(fingerprint, page_cache=None):
+    """
+    ビュー関数用のデコレータ。fingerprint(**view_args) は (ETag の元になる値, max-age 秒, 確定か) か
+    None（キャッシュしない）を返す。If-None-Match が一致し、そのページの画像が残っていれば
+    ビューを呼ばずに 304 を返す。確定したページは page_cache に残し、次からはテンプレートを描かずに返す。
+    ビューが no_store() を呼んだレスポンスには ETag を付けない。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            found = fingerprint(**kwargs)
+            if found is None:
+                return view(**kwargs)
+            parts, max_age, final = found
+            etag = make_etag(request.endpoint, request.path, parts)
+            cache_control = f"private, max-age={max_age}"
+            use_page_cache = page_cache is not None and final
+            touch = page_cache.touch if page_cache is not None else None
+
+            if etag in request.if_none_match and _still_valid(etag, touch):
+                resp = make_response("", 304)
+            elif use_page_cache and (page := page_cache.get(etag)) is not None:
+                resp = make_response(page[0])
+                resp.mimetype = page[1]
+                _remember_etag(etag, page[2])
+            else:
+                started = time.perf_counter()
+                resp = make_response(view(**kwargs))
+                if g.get("no_http_cache"):
+                    resp.headers["Cache-Control"] = "no-store"
+                    return resp
+                if resp.status_code != 200:
+                    return resp
+                deps = g.get("page_deps", ())
+                if use_page_cache:
+                    page_cache.put(etag, resp.get_data(), resp.mimetype, time.perf_counter() - started, deps)
+                _remember_etag(etag, deps)
+            resp.set_etag(etag)
+            resp.headers["Cache-Control"] = cache_control
+            return resp
+        return wrapper
+    return decorator
@@ -0,0 +1,35 @@
+"""
+最新サンプルの受け渡しファイル（data/latest.json）。
+
+lora_logger が CSV に1行書くたびに同じ値をここへ原子的に書き出し、
+Web アプリはディレクトリや CSV を走査せずにこのファイルだけを読む。
+"""
+import json
+import os
+
+LATEST_STATUS_PATH = os.path.join("data", "latest.json")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def write_latest(sample, path=LATEST_STATUS_PATH):
+    """
+    sample（dict: timestamp/red/yellow/green/current）を一時ファイル経由で置き換える。
+    読み手が書きかけのファイルを見ることはない。
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sample, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_latest(path=LATEST_STATUS_PATH):
+    """最新サンプル（dict）を返す。無い・壊れている場合は None。"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            sample = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(sample, dict) or "timestamp" not in sample:
+        return None
+    return sample
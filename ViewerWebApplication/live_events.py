@@ -0,0 +1,89 @@
+"""
+ダッシュボード向けの変更通知（Server-Sent Events の配信元）。
+
+lora_logger（LoggerService）は別プロセスで data/latest.json を更新するので、
+Web アプリ側では購読者がいる間だけスレッド1本で元ファイルの (サイズ, mtime) を見張り、
+変わったときだけ中身を読み直す。データが前回と違うイベントだけペイロード（HTML）を作って
+全購読者へ配る。ペイロードの生成は変化1回につき1回で、接続数には比例しない。
+"""
+import threading
+import time
+
+
+class ChangeNotifier:
+    """
+    sources() は元データの指紋（stat 程度で取れる値）、snapshot() は {イベント名: データ}、
+    render(name, data) はデータから配信するペイロードを作る関数。
+    購読者がいる間は poll_interval 秒ごとに sources() を呼び、変わっていれば snapshot() を取り直して、
+    データが変わったイベントだけ render し、バージョン番号を振って購読者を起こす。
+    最後の購読者が抜けたら監視スレッドは止まり、次の購読で起動し直す。
+    """
+
+    def __init__(self, snapshot, sources, render=None, poll_interval=1.0):
+        self._snapshot = snapshot
+        self._sources = sources
+        self._render = render
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._version = 0
+        self._events = {}  # name -> (version, payload)
+        self._data = {}    # name -> payload の元にしたデータ（変化の判定用）
+        self._subscribers = 0
+        self._thread = None
+
+    def subscribe(self):
+        """購読を始める（監視スレッドが止まっていれば起動する）。終わったら unsubscribe() を呼ぶこと。"""
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch_loop, daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    def _watch_loop(self):
+        last_sources = None
+        while True:
+            with self._cond:
+                if self._subscribers <= 0:
+                    self._thread = None
+                    return
+            try:
+                sources = self._sources()
+                if sources != last_sources:
+                    self.publish(self._snapshot())
+                    last_sources = sources
+            except Exception as e:
+                print(f"変更通知エラー: {e}")
+            time.sleep(self.poll_interval)
+
+    def publish(self, snapshot):
+        """データが変わったイベントだけペイロードを作り直して新しいバージョンで登録し、待機中の購読者を起こす。"""
+        changed = {}
+        with self._cond:
+            for name, data in snapshot.items():
+                if name not in self._data or self._data[name] != data:
+                    changed[name] = data
+        if not changed:
+            return
+        # テンプレートの描画はロックの外で（購読者の wait を止めない）
+        payloads = {name: self._render(name, data) if self._render else data for name, data in changed.items()}
+        with self._cond:
+            for name, payload in payloads.items():
+                self._version += 1
+                self._events[name] = (self._version, payload)
+                self._data[name] = changed[name]
+            self._cond.notify_all()
+
+    def wait(self, since, timeout):
+        """
+        バージョン since より新しいイベントを [(version, name, payload), ...] で返す。
+        無ければ timeout 秒まで待ち、それでも無ければ空リスト。
+        """
+        with self._cond:
+            if self._version <= since:
+                self._cond.wait(timeout)
+            events = [(v, name, payload) for name, (v, payload) in self._events.items() if v > since]
+        return sorted(events, key=lambda e: e[0])
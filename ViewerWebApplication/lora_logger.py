@@ -2,16 +2,66 @@ import serial
 import threading
 import time
 import datetime
-import csv
+import logging
 import os
 
+from frame_codec import FrameParser, LightFrame, decode_frame
+from latest_status import LATEST_STATUS_PATH, write_latest
+from machines import DEFAULT_MACHINE, machine_file, partition
+from minute_aggregator import RAW_RECORD, MinuteAggregator, agg_csv_row, pack_raw
+from sensor_writer import DayBinaryWriter, DayCsvWriter
+
+SENSOR_DIR = os.path.join("data", "sensor")          # 1分ごとの CSV（Webアプリが読む）
+FAST_SENSOR_DIR = os.path.join("data", "sensor_fast")  # 高頻度モードのサンプル CSV
+AGG_SENSOR_DIR = os.path.join("data", "sensor_agg")    # 受信パケットの1分集計 CSV
+RAW_SENSOR_DIR = os.path.join("data", "sensor_raw")    # 受信パケットそのもの（固定長バイナリ）
+FSYNC_INTERVAL_SEC = 600  # CSV 本体を fsync する間隔（それまではジャーナルで保護）
+
+# LoRa 受信機（ゲートウェイ）のポート → その受信機が受け持つ機械。ポートごとに受信スレッドを立てる。
+# 送信側のフレームには送信元が無い（先頭3バイトは固定の宛先アドレスとチャンネル）ので、
+# 機械ごとに別チャンネルの受信機を置き、どのポートで受けたかで機械を決める
+SERIAL_PORTS = {"/dev/ttyUSB0": DEFAULT_MACHINE}
+BAUDRATE = 9600
+RECONNECT_SEC = 5  # ポートが開けない・切断されたときの再接続間隔
+LOG_LEVEL = "INFO"  # "DEBUG" で受信フレームと値をすべて表示
+
+log = logging.getLogger("lora_logger")
+
 class LoggerService:
-    def __init__(self):
+    """
+    受信した最新値を毎分0秒に data/sensor/<日付>.csv へ1行書く。
+    fast_interval_sec（60 の約数）を指定すると、その間隔のサンプルも
+    data/sensor_fast/<日付>.csv に書く（1分ぶんまとめて書き込む）。
+    aggregate=True なら受信した全パケットを1分ごとに集計して data/sensor_agg/ に、
+    raw_stream=True なら受信パケットをそのまま data/sensor_raw/<日付>.bin に残す。
+    data/sensor/ の CSV の形式はどのモードでも変わらない。
+    既定以外の機械は各ディレクトリの下の <機械>/ と data/latest_<機械>.json に書く。
+    """
+
+    def __init__(self, machine=DEFAULT_MACHINE, fast_interval_sec=None, fsync_interval_sec=FSYNC_INTERVAL_SEC,
+                 aggregate=False, raw_stream=False):
+        if fast_interval_sec is not None and (fast_interval_sec <= 0 or 60 % fast_interval_sec):
+            raise ValueError("fast_interval_sec は 60 の約数（秒）で指定してください")
         self._lock = threading.Lock()
         self._lux_red = 0
         self._lux_yellow = 0
         self._lux_green = 0
         self._current_value = 0.0
+        self.machine = machine
+        self.fast_interval_sec = fast_interval_sec
+        self._latest_path = machine_file(LATEST_STATUS_PATH, machine)
+        self._writer = DayCsvWriter(partition(SENSOR_DIR, machine), fsync_interval_sec=fsync_interval_sec)
+        self._fast_writer = None
+        if fast_interval_sec is not None:
+            self._fast_writer = DayCsvWriter(partition(FAST_SENSOR_DIR, machine), fsync_interval_sec=fsync_interval_sec)
+        self._aggregator = None
+        self._agg_writer = None
+        if aggregate:
+            self._aggregator = MinuteAggregator(time.time())
+            self._agg_writer = DayCsvWriter(partition(AGG_SENSOR_DIR, machine), fsync_interval_sec=fsync_interval_sec)
+        self._raw_writer = None
+        if raw_stream:
+            self._raw_writer = DayBinaryWriter(partition(RAW_SENSOR_DIR, machine), RAW_RECORD.size, fsync_interval_sec=fsync_interval_sec)
         self._running = True
         self._thread = threading.Thread(target=self._logging_loop)
         self._thread.start()
@@ -21,100 +71,174 @@ class LoggerService:
             self._lux_red = red
             self._lux_yellow = yellow
             self._lux_green = green
+            if self._aggregator is not None:
+                self._aggregator.add_lights(red, yellow, green, time.time())
+        if self._raw_writer is not None:
+            self._write_raw(b"D", red=red, yellow=yellow, green=green)
 
     def set_current_value(self, current):
         with self._lock:
             self._current_value = current
+            if self._aggregator is not None:
+                self._aggregator.add_current(current, time.time())
+        if self._raw_writer is not None:
+            self._write_raw(b"C", current=current)
+
+    def _write_raw(self, kind, **values):
+        now = datetime.datetime.now()
+        ms = ((now.hour * 60 + now.minute) * 60 + now.second) * 1000 + now.microsecond // 1000
+        self._raw_writer.append(now.strftime("%Y-%m-%d"), pack_raw(ms, kind, **values))
 
     def stop(self):
         self._running = False
         self._thread.join()
 
     def _logging_loop(self):
-        print("logging start")
-        while self._running:
-            now = datetime.datetime.now()
-            next_minute = (now + datetime.timedelta(minutes=1)).replace(second=0, microsecond=0)
-            time_to_wait = (next_minute - now).total_seconds()
-
-            time.sleep(time_to_wait)
-
-            with self._lock:
-                red = self._lux_red
-                yellow = self._lux_yellow
-                green = self._lux_green
-                current = self._current_value
-            
-            print("csv write")
-            print(red)
-            print(yellow)
-            print(green)
-            print(current)
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-
-            # 保存先ディレクトリを指定
-            base_dir = os.path.join("data", "sensor")
-            os.makedirs(base_dir, exist_ok=True)  # ディレクトリが無ければ作成
-
-            filename = os.path.join(base_dir, f"{date_str}.csv")
-            line = [timestamp, red, yellow, green, current]
-
-            try:
-                with open(filename, "a", newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(line)
-            except Exception as e:
-                print(f"ログ書き込みエラー: {e}")
+        log.info(f"logging start: {self.machine}")
+        interval = self.fast_interval_sec or 60
+        try:
+            while self._running:
+                now = datetime.datetime.now()
+                next_tick = now.replace(microsecond=0) + datetime.timedelta(seconds=interval - now.second % interval)
+                time.sleep((next_tick - now).total_seconds())
+
+                with self._lock:
+                    red = self._lux_red
+                    yellow = self._lux_yellow
+                    green = self._lux_green
+                    current = self._current_value
+                    agg = None
+                    if self._aggregator is not None and next_tick.second == 0:
+                        agg = self._aggregator.roll(time.time())
+
+                written_at = datetime.datetime.now()
+                timestamp = written_at.strftime("%H:%M:%S")
+                date_str = written_at.strftime("%Y-%m-%d")
+                line = [timestamp, red, yellow, green, current]
+
+                if self._fast_writer is not None:
+                    self._fast_writer.append(date_str, line)
+                if next_tick.second != 0:
+                    continue  # 高頻度モードの途中のサンプル（1分ぶんまとめて書く）
+
+                try:
+                    self._writer.append(date_str, line)
+                    self._writer.flush()
+                    if self._fast_writer is not None:
+                        self._fast_writer.flush()
+                    if agg is not None:
+                        # その時刻までの1分間の集計
+                        self._agg_writer.append(date_str, agg_csv_row(timestamp, agg))
+                        self._agg_writer.flush()
+                    if self._raw_writer is not None:
+                        self._raw_writer.flush()
+                except Exception as e:
+                    log.error(f"ログ書き込みエラー: {e}")
+                    continue
+
+                # Webアプリ向けに最新値を公開（CSV を走査せずに読めるように）
+                try:
+                    write_latest({
+                        "timestamp": f"{date_str} {timestamp}",
+                        "red": red,
+                        "yellow": yellow,
+                        "green": green,
+                        "current": current,
+                    }, self._latest_path)
+                except Exception as e:
+                    log.error(f"最新値書き込みエラー: {e}")
+        finally:
+            for writer in (self._writer, self._fast_writer, self._agg_writer, self._raw_writer):
+                if writer is None:
+                    continue
+                try:
+                    writer.close()
+                except Exception as e:
+                    log.error(f"ログ書き込みエラー: {e}")
+
+class MachineLoggers:
+    """機械ごとの LoggerService（同じ機械を受け持つポートが複数あっても1つ）。"""
+
+    def __init__(self, **options):
+        self._options = options
+        self._lock = threading.Lock()
+        self._loggers = {}
 
-def data_receive_action(data, logger):
-    if len(data) < 4:
-        return
+    def get(self, machine):
+        with self._lock:
+            logger = self._loggers.get(machine)
+            if logger is None:
+                log.info(f"機械 {machine} の記録を開始")
+                logger = self._loggers[machine] = LoggerService(machine, **self._options)
+            return logger
 
-    try:    
-        mode = chr(data[3])
-    except Exception:
-        return
+    def stop(self):
+        with self._lock:
+            loggers = list(self._loggers.values())
+        for logger in loggers:
+            logger.stop()
+
+def record_receive_action(record, logger):
+    """解読済みのフレームを受信したポートの機械の LoggerService に渡す。"""
+    if type(record) is LightFrame:
+        log.debug("照度: 赤=%d 黄=%d 緑=%d", record.red, record.yellow, record.green)
+        logger.set_pat_light_values(record.red, record.yellow, record.green)
+    else:
+        log.debug("電流: %s", record.current)
+        logger.set_current_value(record.current)
 
-    if mode == 'C':
+def data_receive_action(data, logger):
+    """1フレーム（CRLF まで）を解読して記録する。"""
+    record = decode_frame(data)
+    if record is None:
+        log.warning(f"フレーム解読失敗: {bytes(data)!r}")
+        return
+    record_receive_action(record, logger)
+
+def serial_receive_loop(port, logger, stop_event, baudrate=BAUDRATE):
+    """
+    1ポート分の受信ループ（受信したフレームはすべて logger の機械のもの）。
+    届いたバイトを待ってブロックし（最大1秒）、
+    届いた分だけまとめて読んでフレームに切り出す。切断されたら再接続する。
+    """
+    while not stop_event.is_set():
+        parser = FrameParser()
         try:
-            for i in range(4, len(data) - 1):
-                if data[i] == 0x0D and data[i + 1] == 0x0A:
-                    last_index = i - 1
-                    float_bytes = data[4:last_index + 1]
-                    float_str = bytes(float_bytes).decode("ascii")
-                    current = float(float_str)
-                    print(current)
-                    logger.set_current_value(current)
-                    break
-        except Exception as e:
-            print(f"電流変換失敗: {e}")
-
-    elif mode == 'D':
-        if len(data) >= 10:
-            red = (data[4] << 8) | data[5]
-            yellow = (data[6] << 8) | data[7]
-            green = (data[8] << 8) | data[9]
-            print(red)
-            print(yellow)
-            print(green)
-            logger.set_pat_light_values(red, yellow, green)
-
-def main():
-    print("start main")
-    logger = LoggerService()
+            with serial.Serial(port, baudrate, timeout=1) as ser:
+                log.info(f"{port} 受信開始: {logger.machine}")
+                while not stop_event.is_set():
+                    data = ser.read(ser.in_waiting or 1)
+                    if not data:
+                        continue
+                    for record in parser.feed(data):
+                        log.debug("%s: %s", port, record)
+                        record_receive_action(record, logger)
+        except serial.SerialException as e:
+            log.warning(f"{port} 受信エラー（{RECONNECT_SEC}秒後に再接続）: {e}")
+            stop_event.wait(RECONNECT_SEC)
+
+def main(ports=SERIAL_PORTS, log_level=LOG_LEVEL):
+    logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s %(message)s")
+    log.info("start main")
+    loggers = MachineLoggers()
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=serial_receive_loop, args=(port, loggers.get(machine), stop_event), daemon=True)
+        for port, machine in ports.items()
+    ]
+    for t in threads:
+        t.start()
     try:
-        with serial.Serial("/dev/ttyUSB0", 9600, timeout=1) as ser:
-            while True:
-                if ser.in_waiting:
-                    data = ser.read_until(b'\r\n')
-                    print(data)
-                    if data:
-                        data_receive_action(data, logger)
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=1)
     except KeyboardInterrupt:
-        print("終了します")
+        log.info("終了します")
     finally:
-        logger.stop()
+        stop_event.set()
+        for t in threads:
+            t.join(timeout=2)
+        loggers.stop()
 
 if __name__ == "__main__":
     main()
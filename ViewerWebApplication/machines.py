@@ -0,0 +1,42 @@
+"""
+機械（設備）ごとのデータ置き場。
+
+既定の機械（A214）は従来どおり data/sensor/ 直下・data/latest.json などを使い、
+2台目以降は data/sensor/<機械>/ や data/latest_<機械>.json のように機械ごとに分ける。
+品目CSV は元から data/hinmoku/<機械>_YYYYMMDD.csv なのでそのまま。
+"""
+import os
+import re
+
+DEFAULT_MACHINE = "A214"
+
+_MACHINE_ID = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+
+def is_valid_machine(machine):
+    return bool(_MACHINE_ID.match(machine))
+
+
+def partition(base_dir, machine):
+    """機械ごとのディレクトリ（既定の機械は base_dir そのもの）"""
+    return base_dir if machine == DEFAULT_MACHINE else os.path.join(base_dir, machine)
+
+
+def machine_file(path, machine):
+    """機械ごとのファイル名（既定の機械は path そのもの。例: data/latest_A215.json）"""
+    if machine == DEFAULT_MACHINE:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{machine}{ext}"
+
+
+def list_machines(sensor_dir):
+    """既定の機械＋ sensor_dir 直下に機械ごとのディレクトリがある機械（名前順）"""
+    others = []
+    try:
+        for entry in os.scandir(sensor_dir):
+            if entry.is_dir() and is_valid_machine(entry.name) and entry.name != DEFAULT_MACHINE:
+                others.append(entry.name)
+    except FileNotFoundError:
+        pass
+    return [DEFAULT_MACHINE] + sorted(others)
@@ -0,0 +1,101 @@
+"""
+受信パケットの1分集計（lora_logger の高頻度モード用）。
+
+毎分0秒の値だけを残すと、その間のランプ点滅や電流の山が消える。
+ここでは C/D パケットを受けるたびに値を積み、1分ごとに
+min / max / mean / last と、ランプごとの「その分のうち点灯していた割合」を出す。
+"""
+import struct
+
+from state_classifier import THRESHOLDS
+
+LAMPS = ("red", "yellow", "green")
+FIELDS = LAMPS + ("current",)
+
+# 1分集計 CSV（data/sensor_agg/<日付>.csv）の列。見出し行は書かない
+AGG_COLUMNS = (
+    ["time"]
+    + [f"{lamp}_{agg}" for lamp in LAMPS for agg in ("min", "max", "mean", "last", "on_ratio")]
+    + [f"current_{agg}" for agg in ("min", "max", "mean", "last")]
+    + ["samples"]
+)
+
+# 生サンプル（data/sensor_raw/<日付>.bin）の1レコード：
+# 0:00 からのミリ秒, 種別（b"C"/b"D"）, 赤, 黄, 緑, 電流（D なら電流は NaN、C なら照度は 0）
+RAW_RECORD = struct.Struct("<Ic3Hf")
+
+
+def agg_csv_row(timestamp, row):
+    """集計 dict を AGG_COLUMNS 順の CSV 行（値が無い列は空）にする。"""
+    return [timestamp] + ["" if row[c] is None else row[c] for c in AGG_COLUMNS[1:]]
+
+
+def pack_raw(ms_of_day, kind, red=0, yellow=0, green=0, current=float("nan")):
+    return RAW_RECORD.pack(ms_of_day, kind, red, yellow, green, current)
+
+
+class MinuteAggregator:
+    """
+    add_lights/add_current で受信値を積み、roll(t) でその分の集計行（dict）を返す。
+    時刻 t は time.time() の秒。点灯割合は「前の値がどれだけの時間続いたか」で重み付けする。
+    """
+
+    def __init__(self, start):
+        self._start = start
+        self._last = {name: None for name in FIELDS}
+        self._since = {name: start for name in FIELDS}
+        self._reset()
+
+    def _reset(self):
+        self._count = {name: 0 for name in FIELDS}
+        self._sum = {name: 0.0 for name in FIELDS}
+        self._min = {name: None for name in FIELDS}
+        self._max = {name: None for name in FIELDS}
+        self._on_sec = {lamp: 0.0 for lamp in LAMPS}
+        self._samples = 0
+
+    def _hold(self, lamp, t):
+        # 直前の値が t まで続いたものとして点灯時間を加算
+        last = self._last[lamp]
+        if last is not None and last >= THRESHOLDS[lamp]:
+            self._on_sec[lamp] += max(0.0, t - self._since[lamp])
+        self._since[lamp] = t
+
+    def _add(self, name, value, t):
+        if name in LAMPS:
+            self._hold(name, t)
+        self._count[name] += 1
+        self._sum[name] += value
+        self._min[name] = value if self._min[name] is None else min(self._min[name], value)
+        self._max[name] = value if self._max[name] is None else max(self._max[name], value)
+        self._last[name] = value
+
+    def add_lights(self, red, yellow, green, t):
+        self._add("red", red, t)
+        self._add("yellow", yellow, t)
+        self._add("green", green, t)
+        self._samples += 1
+
+    def add_current(self, current, t):
+        self._add("current", current, t)
+        self._samples += 1
+
+    def roll(self, t):
+        """
+        [前回の roll, t) の集計を dict で返し、次の分を始める。
+        受信が無かった値の min/max/mean は None、last は前の分から引き継ぐ。
+        """
+        for lamp in LAMPS:
+            self._hold(lamp, t)
+        span = t - self._start
+        row = {"samples": self._samples}
+        for name in FIELDS:
+            row[f"{name}_min"] = self._min[name]
+            row[f"{name}_max"] = self._max[name]
+            row[f"{name}_mean"] = round(self._sum[name] / self._count[name], 3) if self._count[name] else None
+            row[f"{name}_last"] = self._last[name]
+        for lamp in LAMPS:
+            row[f"{lamp}_on_ratio"] = round(self._on_sec[lamp] / span, 3) if span > 0 else None
+        self._start = t
+        self._reset()
+        return row
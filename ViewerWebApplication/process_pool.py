@@ -0,0 +1,59 @@
+"""
+グラフ描画（render_worker）と日別集計（rollup）で共用するプロセスプール。
+
+Web アプリはスレッドで動いているので、fork で子プロセスを作ると、他のスレッドが
+その瞬間に持っていたロックごと複製されて子が固まることがある。子は spawn で起動する。
+プールは1つだけ作って全機械・両方の用途で使い回す（機械が増えてもプロセス数は増えない）。
+子プロセスが1つでも落ちる（メモリ不足・matplotlib の異常終了など）と ProcessPoolExecutor は
+BrokenProcessPool のまま使えなくなるので、そのときは捨てて次の submit で作り直す。
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class SharedPool:
+    """最初に使われたときに max_workers プロセスの ProcessPoolExecutor を作る（spawn）。"""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self.restarts = 0
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def submit(self, fn, *args):
+        """
+        executor().submit と同じ。プールが壊れていれば作り直して投げ直す。
+        返した Future が BrokenProcessPool で終わったら、そのプールは捨てる（次の submit で作り直す）。
+        """
+        executor = self.executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self.discard(executor)
+            executor = self.executor()
+            future = executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._check_broken(executor, f))
+        return future
+
+    def _check_broken(self, executor, future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self.discard(executor)
+
+    def discard(self, executor):
+        """壊れた executor を捨てる（今のプールがそれなら、次の executor() で新しく作る）。"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.restarts += 1
+        print("プロセスプールが壊れたので作り直します")
+        executor.shutdown(wait=False, cancel_futures=True)
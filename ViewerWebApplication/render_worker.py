@@ -0,0 +1,121 @@
+"""
+グラフ PNG のバックグラウンド描画。
+
+ページのリクエスト内で matplotlib を回さず、プロセスプール（process_pool.SharedPool）に
+描画ジョブを投げてすぐに返す。同じキー（日付、または品目区間グラフのキャッシュキー）のジョブが実行中なら新しく投げずに相乗りする。
+日付が変わった直後には、前日（確定分）と当日のグラフを先に描いておく。
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class RenderWorker:
+    """
+    render(*args) -> bool（描けたら True）を pool（SharedPool）のプロセスで実行する。
+    render はプロセス間で受け渡すのでモジュール直下の関数であること。
+    on_rendered(out_path) は描き終えるたびに（このプロセスで）呼ばれる。
+    子プロセスが落ちたジョブは失敗として実行中から外し、次の submit で（作り直したプールに）投げ直す。
+    """
+
+    def __init__(self, render, pool, on_rendered=None):
+        self._render = render
+        self._pool = pool
+        self._on_rendered = on_rendered
+        self._lock = threading.Lock()
+        self._pending = {}   # key -> Future
+        self._daily_thread = None
+
+    def submit(self, key, out_path, *args):
+        """
+        ジョブを投げて Future を返す。同じ key が実行中ならその Future を返す。
+        render には (out_path, *args) を渡す。
+        """
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._pool.submit(self._render, out_path, *args)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._finish(key, out_path, f))
+        return future
+
+    def _finish(self, key, out_path, future):
+        try:
+            ok = future.result()
+        except Exception as e:
+            print(f"グラフ描画エラー {key}: {e}")
+            ok = False
+        with self._lock:
+            self._pending.pop(key, None)
+        if ok and self._on_rendered is not None:
+            self._on_rendered(out_path)
+
+    def start_daily(self, jobs, delay_sec=60):
+        """
+        毎日 0:00 の delay_sec 秒後に jobs(today) を呼ぶスレッドを起動する
+        （2回目以降は何もしない）。jobs の中で submit する想定。
+        """
+        with self._lock:
+            if self._daily_thread is not None:
+                return
+            self._daily_thread = threading.Thread(target=self._daily_loop, args=(jobs, delay_sec), daemon=True)
+            self._daily_thread.start()
+
+    def _daily_loop(self, jobs, delay_sec):
+        while True:
+            now = datetime.now()
+            next_run = datetime(now.year, now.month, now.day) + timedelta(days=1, seconds=delay_sec)
+            time.sleep((next_run - now).total_seconds())
+            try:
+                jobs(next_run.date())
+            except Exception as e:
+                print(f"日次プリレンダーエラー: {e}")
+
+
+# ---- 子プロセスが落ちたあとの確認（python render_worker.py）----
+
+def _check_job(out_path, crash):
+    if crash:
+        os._exit(1)  # メモリ不足などで子プロセスが落ちた場合の代わり
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write("ok")
+    return True
+
+
+def _crash_check():
+    """子プロセスを落としたあとも、同じキーを投げ直せば作り直したプールで描けることを確かめる。"""
+    import tempfile
+    from concurrent.futures import wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    from process_pool import SharedPool
+
+    pool = SharedPool(max_workers=2)
+    rendered = []
+    worker = RenderWorker(_check_job, pool, on_rendered=rendered.append)
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, "graph.png")
+        crashed = worker.submit("day", out_path, True)
+        wait([crashed], timeout=60)
+        assert isinstance(crashed.exception(), BrokenProcessPool)
+        for _ in range(100):  # done コールバック（実行中から外す）を待つ
+            if "day" not in worker._pending:
+                break
+            time.sleep(0.05)
+        assert "day" not in worker._pending
+
+        assert worker.submit("day", out_path, False).result(timeout=60) is True
+        for _ in range(100):
+            if rendered:
+                break
+            time.sleep(0.05)
+        assert rendered == [out_path] and os.path.exists(out_path)
+        assert pool.restarts == 1
+    pool.executor().shutdown()
+    print("子プロセスが落ちたあとの再描画 OK")
+
+
+if __name__ == "__main__":
+    _crash_check()
@@ -0,0 +1,253 @@
+"""
+日別ロールアップ（集計済みテーブル）。
+
+data/rollup.sqlite3 に 1日=1行で、状態別秒数・行数・電流/照度の min/max/avg を持つ。
+元CSVの (サイズ, mtime) を記録しておき、変わっていればその日だけ集計し直す。
+過去日は final=1（確定）、当日は final=0 で CSV が伸びるたびに更新される。
+複数日の集計し直しが必要なときは共用のプロセスプール（process_pool.SharedPool）で日ごとに並列に読む。
+"""
+import os
+import sqlite3
+import threading
+from datetime import date as date_cls
+
+import numpy as np
+
+from day_data import load_day_data
+from state_classifier import STATES
+
+# STATES と同じ並びの列名
+STATE_COLUMNS = ["processing", "manual", "completed", "alarm", "unknown"]
+VALUE_COLUMNS = ["current", "red", "yellow", "green"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    date TEXT PRIMARY KEY,
+    csv_size INTEGER NOT NULL,
+    csv_mtime_ns INTEGER NOT NULL,
+    final INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    {states},
+    {values}
+)
+""".format(
+    states=",\n    ".join(f"sec_{c} INTEGER NOT NULL" for c in STATE_COLUMNS),
+    values=",\n    ".join(f"{v}_{agg} REAL" for v in VALUE_COLUMNS for agg in ("min", "max", "avg")),
+)
+
+# 期間別集計のグループキー（週は月曜始まりで、その週の月曜日の日付）
+PERIOD_KEYS = {
+    "day": "date",
+    "week": "date(date, '-6 days', 'weekday 1')",
+    "month": "substr(date, 1, 7)",
+}
+
+_COLUMNS = (
+    ["date", "csv_size", "csv_mtime_ns", "final", "rows"]
+    + [f"sec_{c}" for c in STATE_COLUMNS]
+    + [f"{v}_{agg}" for v in VALUE_COLUMNS for agg in ("min", "max", "avg")]
+)
+
+
+def _stats(values):
+    """(min, max, avg)。有効値が無ければ None の組。"""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return None, None, None
+    return float(values.min()), float(values.max()), float(values.mean())
+
+
+def summarize_day(day):
+    """DayData から1日分のロールアップ行（dict）を作る。"""
+    row = {
+        "date": day.date_str,
+        "rows": len(day),
+        "final": int(day.day_start.date() < date_cls.today()),
+    }
+    secs = day.state_seconds()
+    for state, col in zip(STATES, STATE_COLUMNS):
+        row[f"sec_{col}"] = secs[state]
+    for name in VALUE_COLUMNS:
+        row[f"{name}_min"], row[f"{name}_max"], row[f"{name}_avg"] = _stats(getattr(day, name))
+    return row
+
+
+def _summarize_with_fingerprint(day):
+    row = summarize_day(day)
+    row["csv_size"] = day.size
+    row["csv_mtime_ns"] = day.mtime_ns
+    return row
+
+
+def _summarize_csv(data_dir, date_str):
+    """ワーカープロセス用：CSV を読み込んで1日分のロールアップ行を返す（無ければ None）。"""
+    day = load_day_data(data_dir, date_str)
+    if day is None:
+        return None
+    return _summarize_with_fingerprint(day)
+
+
+def state_seconds_of(row):
+    """ロールアップ行から {state: 秒} を取り出す。"""
+    return {state: row[f"sec_{col}"] for state, col in zip(STATES, STATE_COLUMNS)}
+
+
+class RollupStore:
+    """
+    日別ロールアップの永続ストア。
+    load_day は date_str -> DayData（無ければ None）を返す関数（DayCache 経由を想定）。
+    pool（SharedPool）を渡すと、集計し直す日が複数あるときにそのプロセスで並列に読む
+    （グラフ描画・他の機械と同じプールを使う）。None なら load_day で逐次。
+    """
+
+    def __init__(self, db_path, data_dir, load_day, pool=None):
+        self.db_path = db_path
+        self.data_dir = data_dir
+        self.load_day = load_day
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute(_SCHEMA)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_day(self, date_str):
+        """
+        1日分のロールアップ行（dict）を返す。CSV が無ければ None。
+        記録済みの指紋と CSV が一致しなければ集計し直して保存する。
+        """
+        return self.get_days([date_str]).get(date_str)
+
+    def _fresh_row(self, date_str):
+        """
+        (記録済みの行, CSV が有るか)。行は指紋が CSV と一致するときだけ返す。
+        CSV が無い日の行はここで掃除する。
+        """
+        csv_path = os.path.join(self.data_dir, f"{date_str}.csv")
+        try:
+            st = os.stat(csv_path)
+        except FileNotFoundError:
+            # CSV が消えた日の行を掃除（無ければ書き込みしない）
+            with self._lock:
+                conn = self._connect()
+                if conn.execute("DELETE FROM daily_rollup WHERE date = ?", (date_str,)).rowcount:
+                    conn.commit()
+                else:
+                    conn.rollback()
+            return None, False
+
+        with self._lock:
+            cur = self._connect().execute("SELECT * FROM daily_rollup WHERE date = ?", (date_str,))
+            row = cur.fetchone()
+        if row is None or row["csv_size"] != st.st_size or row["csv_mtime_ns"] != st.st_mtime_ns:
+            return None, True
+
+        row = dict(row)
+        if not row["final"] and date_str < date_cls.today().isoformat():
+            # 日付が変わった後は CSV が変わらない限り確定扱い
+            row["final"] = 1
+            with self._lock:
+                conn = self._connect()
+                conn.execute("UPDATE daily_rollup SET final = 1 WHERE date = ?", (date_str,))
+                conn.commit()
+        return row, True
+
+    def _summarize_days(self, date_strs):
+        """date_strs を集計し直した [(date_str, 行 or None), ...]。"""
+        if self.pool is not None and len(date_strs) > 1:
+            # 子プロセスが落ちたら（BrokenProcessPool）プールは SharedPool が捨てて次回作り直すので、
+            # 今回の分はこのプロセスで逐次に集計し直す
+            futures = []
+            try:
+                for date_str in date_strs:
+                    futures.append(self.pool.submit(_summarize_csv, self.data_dir, date_str))
+                return [(d, future.result()) for d, future in zip(date_strs, futures)]
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                print(f"並列集計エラー（{len(date_strs)} 日を逐次で再試行）: {type(e).__name__}: {e}")
+
+        rows = []
+        for date_str in date_strs:
+            day = self.load_day(date_str)
+            rows.append((date_str, _summarize_with_fingerprint(day) if day is not None else None))
+        return rows
+
+    def _save(self, row):
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                f"INSERT OR REPLACE INTO daily_rollup ({', '.join(_COLUMNS)}) VALUES ({placeholders})",
+                [row[c] for c in _COLUMNS],
+            )
+            conn.commit()
+
+    def get_days(self, date_strs):
+        """
+        {date_str: 行} を date_strs の順で返す（CSV が無い日は含めない）。
+        集計し直しが必要な日はまとめて _summarize_days に渡す。
+        """
+        result = {}
+        stale = []
+        for date_str in date_strs:
+            row, exists = self._fresh_row(date_str)
+            if row is not None:
+                result[date_str] = row
+            elif exists:
+                stale.append(date_str)
+
+        for date_str, row in self._summarize_days(stale):
+            if row is not None:
+                self._save(row)
+                result[date_str] = row
+        return {d: result[d] for d in date_strs if d in result}
+
+    def forget_missing(self, start_date, end_date, dates):
+        """[start_date, end_date] の行のうち dates（CSV がある日）に無い日の行を消す。"""
+        keep = set(dates)
+        with self._lock:
+            conn = self._connect()
+            cur = conn.execute("SELECT date FROM daily_rollup WHERE date BETWEEN ? AND ?", (start_date, end_date))
+            gone = [(row[0],) for row in cur.fetchall() if row[0] not in keep]
+            if gone:
+                conn.executemany("DELETE FROM daily_rollup WHERE date = ?", gone)
+                conn.commit()
+
+    def state_seconds_between(self, start_date, end_date):
+        """
+        [start_date, end_date]（"YYYY-MM-DD"）に記録済みの日を合計した {state: 秒}。
+        集計の鮮度は呼び出し側で get_day/get_days により確保しておくこと。
+        """
+        cols = ", ".join(f"COALESCE(SUM(sec_{c}), 0)" for c in STATE_COLUMNS)
+        with self._lock:
+            cur = self._connect().execute(
+                f"SELECT {cols} FROM daily_rollup WHERE date BETWEEN ? AND ?",
+                (start_date, end_date),
+            )
+            totals = cur.fetchone()
+        return {state: totals[i] for i, state in enumerate(STATES)}
+
+    def state_seconds_by_period(self, start_date, end_date, period):
+        """
+        [start_date, end_date] の記録済みの日を period（"day"/"week"/"month"）ごとに
+        合計した [(キー, {state: 秒}), ...]（キー昇順）。集計は SQLite 側で行う。
+        """
+        key = PERIOD_KEYS[period]
+        cols = ", ".join(f"SUM(sec_{c})" for c in STATE_COLUMNS)
+        with self._lock:
+            cur = self._connect().execute(
+                f"SELECT {key} AS period, {cols} FROM daily_rollup "
+                f"WHERE date BETWEEN ? AND ? GROUP BY period ORDER BY period",
+                (start_date, end_date),
+            )
+            rows = cur.fetchall()
+        return [(row[0], {state: row[i + 1] for i, state in enumerate(STATES)}) for row in rows]
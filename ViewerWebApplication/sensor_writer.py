@@ -0,0 +1,342 @@
+"""
+日付ごとの CSV への追記（lora_logger 用）。
+
+当日のファイルを開いたままにして追記し、CSV 本体の fsync は fsync_interval_sec ごとに
+まとめて行う。fsync 前の行は先に小さなジャーナル（<base_dir>.journal）へ書いて
+fsync しておき、電源断のあとの起動時に CSV に無い行だけを書き戻す。
+CSV への書き込みが失敗したとき（ディスクが一杯など）は、ジャーナルを空にする前に
+同じ書き戻し（recover）をやり直すので、ジャーナルにだけある行を失わない。
+日付が変われば次の日のファイルに自動で切り替える。
+"""
+import csv
+import io
+import os
+import threading
+import time
+
+
+def format_row(row):
+    """csv.writer と同じ形式（改行 \\r\\n 付き）の1行を返す。"""
+    buf = io.StringIO()
+    csv.writer(buf).writerow(row)
+    return buf.getvalue()
+
+
+class DayCsvWriter:
+    """
+    base_dir/<YYYY-MM-DD>.csv への追記。append() で積み、flush() でまとめて書く。
+    flush() 1回につきジャーナルの fsync が1回なので、電源断で失うのは最後の flush 以降の行だけ。
+    """
+
+    def __init__(self, base_dir, journal_path=None, fsync_interval_sec=600):
+        self.base_dir = base_dir
+        self.journal_path = journal_path or f"{os.path.normpath(base_dir)}.journal"
+        self.fsync_interval_sec = fsync_interval_sec
+        self._pending = []       # [(date_str, 整形済みの行)]
+        self._date_str = None
+        self._file = None
+        self._journal = None
+        self._dirty = False      # CSV に fsync していない行がある
+        self._replay = False     # CSV への書き込みに失敗した（ジャーナルから書き戻すまで空にしない）
+        self._last_sync = time.monotonic()
+        self.recover()
+
+    def _path(self, date_str):
+        return os.path.join(self.base_dir, f"{date_str}.csv")
+
+    def append(self, date_str, row):
+        """1行を積む（flush() するまでディスクには書かない）。"""
+        self._pending.append((date_str, format_row(row)))
+
+    def flush(self):
+        """
+        積んだ行をジャーナルに書いて fsync し、その後 CSV に追記して OS へ渡す。
+        CSV 本体の fsync は前回から fsync_interval_sec 経っていれば行う。
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+
+        # 積んだ行はジャーナルの fsync まで済んでから外す。失敗したらジャーナルを書く前に戻し、
+        # 行は積んだまま次の flush() で書き直す（ディスクが一杯などでも行を失わない）
+        journal = self._open_journal()
+        size = os.fstat(journal.fileno()).st_size
+        try:
+            journal.write("".join(f"{date_str},{line}" for date_str, line in pending))
+            journal.flush()
+            os.fsync(journal.fileno())
+        except OSError:
+            self._abandon_journal(size)
+            raise
+        self._pending = []
+
+        if self._replay:
+            self._replay_journal()
+            return
+        try:
+            for date_str, line in pending:
+                if date_str != self._date_str:
+                    self._rotate(date_str)
+                self._file.write(line)
+            self._file.flush()
+        except OSError:
+            # どこまで CSV に書けたか分からない：ジャーナルは残し、次の flush()/sync() で書き戻す
+            self._replay = True
+            self._close_files()
+            raise
+        self._dirty = True
+
+        if time.monotonic() - self._last_sync >= self.fsync_interval_sec:
+            self.sync()
+
+    def sync(self):
+        """CSV 本体を fsync し、そこまでのジャーナルを空にする。"""
+        if self._replay:
+            self._replay_journal()
+            return
+        if self._file is not None and self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+        if self._journal is not None and self._journal.tell():
+            self._journal.seek(0)
+            self._journal.truncate()
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.sync()
+        for f in (self._file, self._journal):
+            if f is not None:
+                f.close()
+        self._file = self._journal = None
+        self._date_str = None
+
+    def _open_journal(self):
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+            self._journal = open(self.journal_path, "a", newline="", encoding="utf-8")
+        return self._journal
+
+    def _close_files(self):
+        for f in (self._file, self._journal):
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        self._file = self._journal = None
+        self._date_str = None
+
+    def _replay_journal(self):
+        """CSV への書き込みに失敗したあと：ジャーナルの行のうち CSV に無いものを書き戻して空にする。"""
+        self._close_files()
+        self.recover()
+        self._replay = False
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _abandon_journal(self, size):
+        """書き込みに失敗したジャーナルを閉じ、size まで切り詰める（書きかけの行を残さない）。"""
+        journal, self._journal = self._journal, None
+        try:
+            journal.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self.journal_path, size)
+        except OSError:
+            pass
+
+    def _rotate(self, date_str):
+        # 前の日のファイルは fsync して閉じる（ジャーナルは次の sync で空にする）
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._file = open(self._path(date_str), "a", newline="", encoding="utf-8")
+        self._date_str = date_str
+
+    def recover(self):
+        """
+        起動時：ジャーナルに残った行のうち CSV に無いものを書き戻し、ジャーナルを空にする。
+        CSV の最終行が書きかけ（改行なし）ならその行は捨てる。
+        """
+        try:
+            with open(self.journal_path, newline="", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return
+
+        by_date = {}
+        for raw in text.splitlines(keepends=True):
+            if not raw.endswith("\n"):
+                continue  # ジャーナル自体の書きかけ（CSV には書いていない）
+            date_str, sep, line = raw.partition(",")
+            if sep:
+                by_date.setdefault(date_str, []).append(line)
+
+        for date_str, lines in by_date.items():
+            path = self._path(date_str)
+            os.makedirs(self.base_dir, exist_ok=True)
+            with open(path, "a+b") as f:
+                f.seek(0)
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    data = data[:data.rfind(b"\n") + 1]
+                    f.truncate(len(data))
+                have = set(data.decode("utf-8", errors="replace").splitlines(keepends=True))
+                missing = [line for line in lines if line not in have]
+                if missing:
+                    f.write("".join(missing).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            if missing:
+                print(f"ジャーナルから {len(missing)} 行を復旧: {path}")
+
+        with open(self.journal_path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class DayBinaryWriter:
+    """
+    base_dir/<YYYY-MM-DD><ext> への record_size バイト固定長レコードの追記（生サンプル用）。
+    append() はどのスレッドからでも呼べる。flush() でまとめて書き、fsync は間隔を空ける。
+    量が多く復旧の必要も薄いのでジャーナルは使わない（電源断で最後の fsync 以降を失う）。
+    """
+
+    def __init__(self, base_dir, record_size, ext=".bin", fsync_interval_sec=600):
+        self.base_dir = base_dir
+        self.record_size = record_size
+        self.ext = ext
+        self.fsync_interval_sec = fsync_interval_sec
+        self._lock = threading.Lock()
+        self._pending = []       # [(date_str, bytes)]
+        self._date_str = None
+        self._file = None
+        self._last_sync = time.monotonic()
+
+    def append(self, date_str, record):
+        with self._lock:
+            self._pending.append((date_str, record))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        for date_str, record in pending:
+            if date_str != self._date_str:
+                self._rotate(date_str)
+            self._file.write(record)
+        self._file.flush()
+        if time.monotonic() - self._last_sync >= self.fsync_interval_sec:
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        self._date_str = None
+
+    def _rotate(self, date_str):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        os.makedirs(self.base_dir, exist_ok=True)
+        path = os.path.join(self.base_dir, f"{date_str}{self.ext}")
+        self._file = open(path, "ab")
+        # 書きかけのレコード（電源断）があれば、以降のレコードがずれないよう切り詰める
+        size = self._file.seek(0, os.SEEK_END)
+        if size % self.record_size:
+            self._file.truncate(size - size % self.record_size)
+        self._date_str = date_str
+
+
+# ---- 書き込み失敗の確認（python sensor_writer.py）----
+
+class _FullDisk:
+    """room 文字まで書いたら ENOSPC を出すファイル（書き込み失敗の注入用）。"""
+
+    def __init__(self, f, room):
+        self._f = f
+        self.room = room
+
+    def write(self, s):
+        n = min(len(s), self.room)
+        self._f.write(s[:n])
+        self.room -= n
+        if n < len(s):
+            raise OSError(28, "No space left on device")
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def _write_failure_check():
+    """CSV への書き込み・日付の切り替えが失敗しても、ジャーナルの行が CSV に書き戻されることを確かめる。"""
+    import tempfile
+
+    def rows(n):
+        return [[f"08:00:{i:02d}", i, 0, 0, 1.5] for i in range(n)]
+
+    def csv_lines(base_dir, date_str):
+        with open(os.path.join(base_dir, f"{date_str}.csv"), newline="", encoding="utf-8") as f:
+            return f.read().splitlines(keepends=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = os.path.join(tmp, "sensor")
+        writer = DayCsvWriter(base_dir)
+        day1 = rows(6)
+
+        # CSV への追記が途中で ENOSPC（行の途中まで書けている）
+        for row in day1[:2]:
+            writer.append("2025-09-09", row)
+        writer.flush()
+        writer._file = _FullDisk(writer._file, room=10)
+        for row in day1[2:4]:
+            writer.append("2025-09-09", row)
+        try:
+            writer.flush()
+        except OSError:
+            pass
+        else:
+            raise AssertionError("書き込み失敗が注入されていない")
+        # 次の flush()（内部で sync もする）がジャーナルを空にする前に書き戻す
+        writer.fsync_interval_sec = 0
+        for row in day1[4:]:
+            writer.append("2025-09-09", row)
+        writer.flush()
+        assert csv_lines(base_dir, "2025-09-09") == [format_row(row) for row in day1]
+
+        # 次の日のファイルを開けない
+        def cannot_open(date_str):
+            raise OSError(13, "Permission denied")
+
+        rotate = writer._rotate
+        writer._rotate = cannot_open
+        writer.append("2025-09-10", rows(1)[0])
+        try:
+            writer.flush()
+        except OSError:
+            pass
+        writer._rotate = rotate
+        writer.sync()
+        writer.close()
+        assert csv_lines(base_dir, "2025-09-10") == [format_row(rows(1)[0])]
+        assert os.path.getsize(writer.journal_path) == 0
+    print("書き込み失敗からの書き戻し OK")
+
+
+if __name__ == "__main__":
+    _write_failure_check()
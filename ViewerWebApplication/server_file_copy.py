@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import json
 import time
 import tempfile
 import shutil
 import subprocess
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import hashlib
 
 # ===== Config (ASCII only) =====
@@ -15,18 +18,25 @@ SHARE_NAME  = "\u5168\u793e\u516c\u958b\u60c5\u5831"  # "全社公開情報"
 DOMAIN      = "KUMA-DOM"
 USER_ID     = "13045"
 PASSWORD    = "<<<PUT_DOMAIN_PASSWORD_HERE>>>" # IMPORTANT!!! PUT DOMAIN PASSWORD HERE!!!!
-REMOTE_PATH = (
+REMOTE_BASE = (
     "00_\u90e8\u9580\u5225\u60c5\u5831/"
     "90_\u672c\u793e\u5de5\u5834/"
     "\u30d1\u30c8\u30e9\u30a4\u30c8/"
-    "\u4f5c\u696d\u8a18\u9332/"
-    "202509"
-)  # "00_部門別情報/90_本社工場/パトライト/作業記録/202509"
+    "\u4f5c\u696d\u8a18\u9332"
+)  # "00_部門別情報/90_本社工場/パトライト/作業記録"
+# Month folders (YYYYMM) under REMOTE_BASE follow the calendar.
+# The previous month is still watched for this many days after it ends.
+PREV_MONTH_GRACE_DAYS = 3
 
 # Destination under the project directory
 DEST_DIR    = Path(__file__).resolve().parent / "data" / "hinmoku"
+MANIFEST_PATH = DEST_DIR.parent / "hinmoku_manifest.json"
 INTERVAL_SEC = 60
 SMBCLIENT    = "smbclient"
+# "incremental": list, then download only changed files (default)
+# "full": download the whole month folder to a staging dir every cycle
+SYNC_MODE    = "incremental"
+FETCH_WORKERS = 4  # parallel smbclient sessions for downloads
 # ===============================
 
 def log(msg: str) -> None:
@@ -84,35 +94,207 @@ def copy_newer_only(src_root: Path, dst_root: Path) -> None:
                 log(f"[SKIP] {dfile}")
 
 
-def fetch_to_staging(staging: Path) -> None:
+def remove_credentials_file(cred_path: str) -> None:
+    # Best-effort secure delete
+    try:
+        with open(cred_path, "w", encoding="utf-8") as f:
+            f.write("\0" * 256)
+    except Exception:
+        pass
+    try:
+        os.remove(cred_path)
+    except FileNotFoundError:
+        pass
+
+def remote_months(now: datetime) -> list:
+    """Month folders to watch: the current one, plus the previous one right after a rollover."""
+    months = [now.strftime("%Y%m")]
+    if now.day <= PREV_MONTH_GRACE_DAYS:
+        months.insert(0, (now.replace(day=1) - timedelta(days=1)).strftime("%Y%m"))
+    return months
+
+def smb_quote(name: str) -> str:
+    """
+    Quote a name for a smbclient -c command string.
+    smbclient has no escape for '"' and splits -c on every ';' (even inside quotes),
+    so names containing either cannot be passed and raise ValueError.
+    """
+    if any(c in name for c in '";\r\n'):
+        raise ValueError(f"name cannot be passed to smbclient: {name!r}")
+    return f'"{name}"'
+
+def smb(cred_path: str, smb_cmd: str, **kwargs) -> subprocess.CompletedProcess:
+    cmd = [SMBCLIENT, f"//{SERVER_IP}/{SHARE_NAME}", "-A", cred_path, "-c", smb_cmd]
+    return run(cmd, **kwargs)
+
+def fetch_to_staging(staging: Path, month: str) -> None:
     staging.mkdir(parents=True, exist_ok=True)
     cred_path = make_credentials_file(USER_ID, PASSWORD, DOMAIN)
     try:
-        smb_cmd = f'lcd "{staging}"; cd "{REMOTE_PATH}"; recurse ON; prompt OFF; mget *'
-        cmd = [SMBCLIENT, f"//{SERVER_IP}/{SHARE_NAME}", "-A", cred_path, "-c", smb_cmd]
-        run(cmd)
+        smb(cred_path, f'lcd "{staging}"; cd "{REMOTE_BASE}/{month}"; recurse ON; prompt OFF; mget *')
     finally:
-        # Best-effort secure delete
-        try:
-            with open(cred_path, "w", encoding="utf-8") as f:
-                f.write("\0" * 256)
-        except Exception:
-            pass
-        try:
-            os.remove(cred_path)
-        except FileNotFoundError:
-            pass
+        remove_credentials_file(cred_path)
 
-def one_cycle() -> None:
+def one_cycle_full() -> None:
     DEST_DIR.mkdir(parents=True, exist_ok=True)
-    with tempfile.TemporaryDirectory(prefix="hinmoku_stage_") as tmpdir:
-        staging = Path(tmpdir)
-        log("Downloading to staging...")
-        fetch_to_staging(staging)
-        log("Applying diffs (copy newer only)...")
-        copy_newer_only(staging, DEST_DIR)
+    for month in remote_months(datetime.now()):
+        with tempfile.TemporaryDirectory(prefix="hinmoku_stage_") as tmpdir:
+            staging = Path(tmpdir)
+            log(f"Downloading {month} to staging...")
+            fetch_to_staging(staging, month)
+            log("Applying diffs (copy newer only)...")
+            copy_newer_only(staging, DEST_DIR)
     log("Sync done.")
 
+# ----- incremental sync -----
+# One entry of "smbclient ls":
+#   "  A214_20250909.csv      A     1234  Tue Sep  9 08:00:00 2025"
+LS_LINE = re.compile(r"^  (.+?)\s+([A-Z]*)\s+(\d+)\s+(\w{3} \w{3} [ \d]\d \d\d:\d\d:\d\d \d{4})\s*$")
+# With "recurse ON", each subfolder's entries follow a header with its full share path:
+#   "\00_...\202509\sub"
+LS_DIR_HEADER = re.compile(r"^\\(.+?)\s*$")
+
+def parse_ls(output: str, base: str = "") -> dict:
+    """
+    smbclient "recurse ON; ls" output -> {relative path: (size, mtime)} for plain files.
+    Paths are relative to base (the folder listed) and use "/"; folders themselves are skipped.
+    """
+    base = base.strip("/").replace("\\", "/")
+    files = {}
+    subdir = ""
+    for line in output.splitlines():
+        h = LS_DIR_HEADER.match(line)
+        if h:
+            path = h.group(1).replace("\\", "/").strip("/")
+            if base and path.casefold().startswith(base.casefold()):
+                path = path[len(base):].strip("/")
+            subdir = path
+            continue
+        m = LS_LINE.match(line)
+        if not m or "D" in m.group(2):
+            continue
+        name = m.group(1)
+        files[f"{subdir}/{name}" if subdir else name] = (int(m.group(3)), m.group(4))
+    return files
+
+def list_remote(cred_path: str, month: str):
+    """{relative path: (size, mtime)} of the month folder and its subfolders, or None if it does not exist yet."""
+    base = f"{REMOTE_BASE}/{month}"
+    res = smb(cred_path, f'cd "{base}"; recurse ON; ls', check=False, capture_output=True)
+    if res.returncode != 0:
+        if "NT_STATUS_OBJECT_NAME_NOT_FOUND" in res.stdout + res.stderr:
+            return None
+        raise subprocess.CalledProcessError(res.returncode, res.args, res.stdout, res.stderr)
+    return parse_ls(res.stdout, base)
+
+def load_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(manifest: dict) -> None:
+    tmp = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, MANIFEST_PATH)
+
+def fetch_batch(cred_path: str, month: str, names: list, staging: Path) -> None:
+    """Download names (relative paths) from the month folder into staging with one smbclient session."""
+    for name in names:
+        (staging / name).parent.mkdir(parents=True, exist_ok=True)
+    gets = "; ".join("get {} {}".format(smb_quote(name.replace("/", "\\")), smb_quote(name)) for name in names)
+    smb(cred_path, f'lcd "{staging}"; cd "{REMOTE_BASE}/{month}"; prompt OFF; {gets}', capture_output=True)
+
+def apply_file(staged: Path, rel: str, manifest: dict, key: str, size: int, mtime: str) -> None:
+    """Move a downloaded file to DEST_DIR/rel unless its content is unchanged."""
+    dfile = DEST_DIR / rel
+    digest = file_sha1(staged)
+    existed = dfile.exists()
+    old = manifest.get(key)
+    if existed and (old["sha1"] if old else file_sha1(dfile)) == digest:
+        # Remote timestamp changed but content did not: keep the local file (and its mtime)
+        log(f"[SKIP(hash)] {dfile}")
+    else:
+        dfile.parent.mkdir(parents=True, exist_ok=True)
+        part = dfile.with_name(dfile.name + ".part")
+        shutil.copy2(staged, part)
+        os.replace(part, dfile)
+        log(f"[{'UPDATE' if existed else 'NEW '}] {dfile}")
+    manifest[key] = {"size": size, "mtime": mtime, "sha1": digest}
+
+def one_cycle_incremental() -> None:
+    DEST_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest()
+    months = remote_months(datetime.now())
+    failures = []
+    cred_path = make_credentials_file(USER_ID, PASSWORD, DOMAIN)
+    try:
+        for month in months:
+            remote = list_remote(cred_path, month)
+            if remote is None:
+                log(f"Remote folder {month} not found (yet).")
+                continue
+
+            changed = []
+            for name, (size, mtime) in sorted(remote.items()):
+                old = manifest.get(f"{month}/{name}")
+                if old and old["size"] == size and old["mtime"] == mtime and (DEST_DIR / name).exists():
+                    continue
+                try:
+                    smb_quote(name)
+                except ValueError as e:
+                    log(f"[SKIP(name)] {month}/{name}: {e}")
+                    continue
+                changed.append(name)
+            if not changed:
+                continue
+            log(f"{month}: {len(changed)} changed of {len(remote)} files")
+
+            # Split into one batch per worker; each batch is applied (and the manifest saved)
+            # as soon as it arrives, so a failed batch does not throw away the others
+            batches = [changed[i::FETCH_WORKERS] for i in range(min(FETCH_WORKERS, len(changed)))]
+            with tempfile.TemporaryDirectory(prefix="hinmoku_stage_") as tmpdir, \
+                    ThreadPoolExecutor(max_workers=len(batches)) as pool:
+                stagings = [Path(tmpdir) / str(i) for i in range(len(batches))]
+                for staging in stagings:
+                    staging.mkdir()
+                futures = {pool.submit(fetch_batch, cred_path, month, names, staging): (names, staging)
+                           for names, staging in zip(batches, stagings)}
+                for future in as_completed(futures):
+                    names, staging = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        log(f"[FAIL] {month}: batch of {len(names)} files ({names[0]}, ...): {e}")
+                        failures.append(e)
+                        continue
+                    for name in names:
+                        size, mtime = remote[name]
+                        apply_file(staging / name, name, manifest, f"{month}/{name}", size, mtime)
+                    save_manifest(manifest)
+    finally:
+        remove_credentials_file(cred_path)
+
+    # Forget months that are no longer watched
+    stale = [key for key in manifest if key.split("/", 1)[0] not in months]
+    if stale:
+        for key in stale:
+            del manifest[key]
+        save_manifest(manifest)
+    if failures:
+        # Raised after everything that did arrive is applied and saved; the rest is retried next cycle
+        log(f"Sync done, {len(failures)} download batch(es) failed.")
+        raise failures[0]
+    log("Sync done.")
+
+def one_cycle() -> None:
+    if SYNC_MODE == "full":
+        one_cycle_full()
+    else:
+        one_cycle_incremental()
+
 def main() -> None:
     # Sanity: smbclient existence
     try:
@@ -121,7 +303,7 @@ def main() -> None:
         print("smbclient not found. Install it with: sudo apt install smbclient", flush=True)
         raise SystemExit(1)
 
-    log(f"Start watching //{SERVER_IP}/{SHARE_NAME}/{REMOTE_PATH} -> {DEST_DIR}")
+    log(f"Start watching //{SERVER_IP}/{SHARE_NAME}/{REMOTE_BASE}/<YYYYMM> -> {DEST_DIR} ({SYNC_MODE})")
     while True:
         try:
             one_cycle()
@@ -0,0 +1,79 @@
+import numpy as np
+
+# 点灯/消灯の閾値
+THRESHOLDS = {
+    "red": 200,
+    "yellow": 200,
+    "green": 200
+}
+CURRENT_THRESHOLD = 3.0
+
+# 状態コード（STATES の並び = 集計表の表示順）
+STATES = ["加工中", "手動加工中", "加工完了", "アラーム", "不明"]
+STATE_COLORS = ["green", "blue", "yellow", "red", "gray"]
+PROCESSING, MANUAL, COMPLETED, ALARM, UNKNOWN = range(len(STATES))
+
+# 4bitコード（赤<<3 | 黄<<2 | 緑<<1 | 機械動作）→ 状態コード
+STATE_LUT = np.array([
+    # 赤 黄 緑 機械
+    UNKNOWN,     # 0  0  0  0
+    MANUAL,      # 0  0  0  1
+    PROCESSING,  # 0  0  1  0
+    PROCESSING,  # 0  0  1  1
+    COMPLETED,   # 0  1  0  0
+    MANUAL,      # 0  1  0  1
+    PROCESSING,  # 0  1  1  0
+    PROCESSING,  # 0  1  1  1
+    ALARM,       # 1  0  0  0
+    MANUAL,      # 1  0  0  1
+    PROCESSING,  # 1  0  1  0
+    PROCESSING,  # 1  0  1  1
+    COMPLETED,   # 1  1  0  0
+    MANUAL,      # 1  1  0  1
+    PROCESSING,  # 1  1  1  0
+    PROCESSING,  # 1  1  1  1
+], dtype=np.uint8)
+
+
+def light_codes(red, yellow, green, current):
+    """
+    赤/黄/緑/電流の配列を受け取り、4bitコード（uint8配列）を返す。
+    """
+    red = np.asarray(red)
+    yellow = np.asarray(yellow)
+    green = np.asarray(green)
+    current = np.asarray(current)
+    codes = (red >= THRESHOLDS["red"]).astype(np.uint8) << 3
+    codes |= (yellow >= THRESHOLDS["yellow"]).astype(np.uint8) << 2
+    codes |= (green >= THRESHOLDS["green"]).astype(np.uint8) << 1
+    codes |= (current >= CURRENT_THRESHOLD).astype(np.uint8)
+    return codes
+
+
+def classify_states(red, yellow, green, current):
+    """
+    1日分（または1か月分）の配列をまとめて判定し、状態コード（uint8配列）を返す。
+    状態名は STATES[code]、色は STATE_COLORS[code]。
+    """
+    return STATE_LUT[light_codes(red, yellow, green, current)]
+
+
+def light_code(red, yellow, green, current):
+    """1点分の4bitコード（スカラー版）"""
+    return (
+        ((red >= THRESHOLDS["red"]) << 3)
+        | ((yellow >= THRESHOLDS["yellow"]) << 2)
+        | ((green >= THRESHOLDS["green"]) << 1)
+        | (current >= CURRENT_THRESHOLD)
+    )
+
+
+def state_seconds(codes, seconds_per_row=60):
+    """状態コード配列から状態別合計秒数 {state: 秒} を返す（1行=1分）。"""
+    counts = np.bincount(np.asarray(codes, dtype=np.intp), minlength=len(STATES))
+    return seconds_from_counts(counts, seconds_per_row)
+
+
+def seconds_from_counts(counts, seconds_per_row=60):
+    """状態別の行数（STATES 順）を {state: 秒} に変換する。"""
+    return {state: int(counts[i]) * seconds_per_row for i, state in enumerate(STATES)}
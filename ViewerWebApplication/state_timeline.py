@@ -0,0 +1,135 @@
+"""
+ランレングス符号化した1日分の状態タイムライン。
+
+「何分から何分間どの状態か」を (開始分, 分数, 状態コード) の3本の配列で持つ。
+1分ごとに datetime をキーにした辞書を作る代わりに、グラフ描画・区間の切り出し・
+複数区間の合成・状態別合計をすべてこのラン配列の上で行う。
+"""
+import numpy as np
+
+from state_classifier import STATES, STATE_COLORS, seconds_from_counts
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class StateTimeline:
+    """
+    状態ランの列（開始分の昇順・互いに重ならない）。
+    starts/lengths は 0:00 からの分、codes は STATES のインデックス。
+    """
+
+    def __init__(self, starts, lengths, codes):
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.codes = np.asarray(codes, dtype=np.uint8)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [])
+
+    @classmethod
+    def from_minutes(cls, minutes, codes):
+        """
+        分番号と状態コードの配列（行の並び順）からタイムラインを作る。
+        同じ分が複数あれば後の行を採用し、1日の範囲外の分は捨てる。
+        """
+        minutes = np.asarray(minutes, dtype=np.int64)
+        codes = np.asarray(codes, dtype=np.uint8)
+        inside = (minutes >= 0) & (minutes < MINUTES_PER_DAY)
+        minutes, codes = minutes[inside], codes[inside]
+        if len(minutes) == 0:
+            return cls.empty()
+
+        order = np.argsort(minutes, kind="stable")
+        minutes, codes = minutes[order], codes[order]
+        last = np.append(minutes[1:] != minutes[:-1], True)
+        minutes, codes = minutes[last], codes[last]
+
+        # 分が途切れるか状態が変わる位置でランを区切る
+        breaks = np.flatnonzero((np.diff(minutes) != 1) | (np.diff(codes) != 0)) + 1
+        heads = np.concatenate(([0], breaks))
+        lengths = np.diff(np.concatenate((heads, [len(minutes)])))
+        return cls(minutes[heads], lengths, codes[heads])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __eq__(self, other):
+        if not isinstance(other, StateTimeline):
+            return NotImplemented
+        return (np.array_equal(self.starts, other.starts)
+                and np.array_equal(self.lengths, other.lengths)
+                and np.array_equal(self.codes, other.codes))
+
+    @property
+    def ends(self):
+        return self.starts + self.lengths
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.lengths.nbytes + self.codes.nbytes
+
+    def slice(self, start_min, end_min):
+        """[start_min, end_min) に掛かるランだけを、その範囲に切り詰めて返す。"""
+        if not (start_min < end_min) or len(self) == 0:
+            return StateTimeline.empty()
+        lo = np.searchsorted(self.ends, start_min, side="right")
+        hi = np.searchsorted(self.starts, end_min, side="left")
+        starts = np.maximum(self.starts[lo:hi], start_min)
+        ends = np.minimum(self.ends[lo:hi], end_min)
+        return StateTimeline(starts, ends - starts, self.codes[lo:hi])
+
+    def select(self, ranges):
+        """
+        複数の分範囲 [(start_min, end_min), ...] の和集合を切り出して1本にまとめる。
+        範囲が重なっていても同じ分が二重に数えられることはない。
+        """
+        merged = []
+        for s, e in sorted(r for r in ranges if r[0] < r[1]):
+            if merged and s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        if not merged:
+            return StateTimeline.empty()
+        if len(merged) == 1:
+            return self.slice(*merged[0])
+        return StateTimeline.concat([self.slice(s, e) for s, e in merged])
+
+    @classmethod
+    def concat(cls, timelines):
+        """
+        開始分の昇順に並んだ重ならないタイムラインをつなげる。
+        境目で同じ状態が隙間なく続いていれば1本のランに戻す。
+        """
+        parts = [t for t in timelines if len(t)]
+        if not parts:
+            return cls.empty()
+        starts = np.concatenate([t.starts for t in parts])
+        lengths = np.concatenate([t.lengths for t in parts])
+        codes = np.concatenate([t.codes for t in parts])
+        ends = starts + lengths
+        joined = np.append(False, (starts[1:] == ends[:-1]) & (codes[1:] == codes[:-1]))
+        if not joined.any():
+            return cls(starts, lengths, codes)
+        group = np.cumsum(~joined) - 1
+        heads = np.flatnonzero(~joined)
+        return cls(starts[heads], np.bincount(group, weights=lengths).astype(np.int32), codes[heads])
+
+    def exclude(self, code):
+        """状態 code のランを取り除いたタイムライン（例: 不明=灰色を描かない場合）。"""
+        keep = self.codes != code
+        return StateTimeline(self.starts[keep], self.lengths[keep], self.codes[keep])
+
+    def state_minutes(self):
+        """状態別の合計分数（STATES 順の配列）。"""
+        return np.bincount(self.codes, weights=self.lengths, minlength=len(STATES)).astype(np.int64)
+
+    def state_seconds(self):
+        """状態別合計秒数 {state: 秒}。"""
+        return seconds_from_counts(self.state_minutes())
+
+    def color_runs(self):
+        """描画用の [(開始分, 分数, color), ...]。"""
+        return [(start, length, STATE_COLORS[code])
+                for start, length, code in zip(self.starts.tolist(), self.lengths.tolist(), self.codes.tolist())]
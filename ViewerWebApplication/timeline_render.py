@@ -0,0 +1,48 @@
+"""
+1日タイムライン（状態推移グラフ）のベクター描画。
+
+StateTimeline の「同じ状態が続く区間（ラン）」をそのままインライン SVG か
+JSON のラン一覧として出力する。matplotlib で 1 分 1 本の barh を描いて PNG に
+ラスタライズするのに比べ、描画要素は数十個程度で済む。
+"""
+from html import escape
+
+from state_timeline import MINUTES_PER_DAY
+
+# SVG のレイアウト（viewBox 単位。横は 1 分 = 1 単位）
+_LEFT = 30
+_WIDTH = MINUTES_PER_DAY
+_HEIGHT = 120
+_BAR_TOP = 34
+_BAR_HEIGHT = 50
+_AXIS_Y = _BAR_TOP + _BAR_HEIGHT + 6
+
+
+def runs_to_json(timeline):
+    """タイムラインを JSON 化しやすい dict のリストにする（クライアント側描画用）。"""
+    return [{"start": start, "length": length, "color": color} for start, length, color in timeline.color_runs()]
+
+
+def render_svg(timeline, title):
+    """StateTimeline から 1 日分のタイムラインをインライン SVG 文字列で返す。"""
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {_LEFT * 2 + _WIDTH} {_HEIGHT}" '
+        f'style="width: 100%; height: auto; display: block;" role="img" aria-label="{escape(title)}">',
+        f'<text x="{_LEFT + _WIDTH // 2}" y="20" font-size="14" text-anchor="middle">{escape(title)}</text>',
+        f'<rect x="{_LEFT}" y="{_BAR_TOP - 4}" width="{_WIDTH}" height="{_BAR_HEIGHT + 8}" '
+        f'fill="none" stroke="#000" stroke-width="1"/>',
+    ]
+    for start, length, color in timeline.color_runs():
+        parts.append(
+            f'<rect x="{_LEFT + start}" y="{_BAR_TOP}" width="{length}" height="{_BAR_HEIGHT}" fill="{color}"/>'
+        )
+
+    # 目盛り（毎時）
+    for hour in range(25):
+        x = _LEFT + hour * 60
+        parts.append(f'<line x1="{x}" y1="{_AXIS_Y - 2}" x2="{x}" y2="{_AXIS_Y + 2}" stroke="#000"/>')
+        parts.append(
+            f'<text x="{x}" y="{_AXIS_Y + 16}" font-size="11" text-anchor="middle">{hour:02d}:00</text>'
+        )
+    parts.append("</svg>")
+    return "".join(parts)